@@ -1,11 +1,10 @@
 import sqlite3
 from datetime import date
 from pathlib import Path
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Optional
 
+import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import streamlit as st
 import logging
 
@@ -15,7 +14,6 @@ DB_PATH = (Path(__file__).resolve().parent / 'projeto_caged.db')
 # Paleta de cores (ajuste conforme sua identidade visual)
 PRIMARY = '#1F4AA8'
 PALETTE = ['#1F4AA8', '#4E79A7', '#F28E2B', '#E15759', '#76B7B2', '#59A14F', '#EDC948', '#B07AA1', '#9C755F', '#BAB0AC']
-px.defaults.color_discrete_sequence = PALETTE
 
 # Mapas para "traduzir" códigos em nomes amigáveis (usados nos gráficos)
 # Mantemos apenas o contexto geral para simplificar a aplicação
@@ -27,24 +25,84 @@ RACA_MAP = {
     '9': 'Não Identificado',
 }
 
+# Grupos da aba de projeções: nome exibido -> (coluna SQL, legenda por código)
+_GRUPO_NOMES: Dict[str, Tuple[str, Dict[str, str]]] = {
+    'Gênero': ('genero', {'MASC': 'Homens', 'FEM': 'Mulheres'}),
+    'Raça/Cor': ('raca_cor', {'BRANCA': 'Branca', 'PRETA': 'Preta', 'PARDA': 'Parda'}),
+    'Escolaridade': ('grau_instrucao', {
+        '1':'Analfabeto','2':'Fund. Incompl.','3':'Fund. Compl.','4':'Médio Incompl.','5':'Médio Compl.','6':'Sup. Incompl.','7':'Sup. Compl.','8':'Pós-grad.','9':'Mestrado','10':'Doutorado','11':'Pós-doc.'
+    }),
+    'Deficiência': ('tipodedeficiência', {
+        '0':'Não deficiente','1':'Física','2':'Auditiva','3':'Visual','4':'Intelectual','5':'Múltipla','6':'Reabilitado','9':'Não Identificado'
+    }),
+}
+# Tuplas fixas: o selectbox recebe o mesmo objeto a cada rerun
+_GRUPO_TIPOS = tuple(_GRUPO_NOMES.keys())
+_GRUPO_OPCOES: Dict[str, Tuple[str, ...]] = {nome: tuple(leg.keys()) for nome, (_, leg) in _GRUPO_NOMES.items()}
+# Opções da Série B por grupo e por escolha da Série A (todas menos a própria escolha)
+_OPCOES_B_BY_A: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    nome: {a: tuple(c for c in opcoes if c != a) or opcoes for a in opcoes}
+    for nome, opcoes in _GRUPO_OPCOES.items()
+}
+
+# Dimensões dos gráficos históricos: coluna do gráfico -> (coluna SQL, mapa de nomes ou None)
+HIST_DIMS: Dict[str, Tuple[str, Optional[Dict[str, str]]]] = {
+    'genero_nome': ('genero', GENERO_MAP),
+    'raca_nome': ('raca_cor', RACA_MAP),
+    'grau_instrucao': ('grau_instrucao', None),
+    'tipodedeficiência': ('"tipodedeficiência"', None),
+}
+
+def _rgba(cor_hex: str, alpha: float) -> str:
+    """'#RRGGBB' -> 'rgba(r, g, b, alpha)' (preenchimento translúcido na cor da série)."""
+    r, g, b = (int(cor_hex[i:i + 2], 16) for i in (1, 3, 5))
+    return f'rgba({r}, {g}, {b}, {alpha})'
+
+def _plotly():
+    """Importa o plotly sob demanda (só quando uma aba vai desenhar) e aplica a paleta."""
+    import plotly.express as px
+    import plotly.graph_objects as go
+    px.defaults.color_discrete_sequence = PALETTE
+    return px, go
+
 # --- FUNÇÕES DE DADOS (COM CACHE CORRIGIDO) ---
 
-def _db_cache_version() -> float:
-    """Versão de cache baseada no mtime do arquivo do banco.
-    Ao alterar o DB, esse valor muda e invalida o cache do Streamlit.
+@st.cache_resource
+def get_conn() -> sqlite3.Connection:
+    """Conexão única (somente leitura) compartilhada entre reruns e sessões do Streamlit.
+    Índices e WAL são criados pelo storage.py. Sem o arquivo, levanta FileNotFoundError
+    (não cacheado pelo Streamlit) em vez de deixar o sqlite3 criar um banco vazio.
     """
-    try:
-        return DB_PATH.stat().st_mtime
-    except Exception:
-        return 0.0
+    if not DB_PATH.exists():
+        raise FileNotFoundError(f"Banco não encontrado: {DB_PATH}")
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+    conn.execute('PRAGMA query_only=1;')
+    conn.execute('PRAGMA mmap_size=268435456;')  # 256MB
+    conn.execute('PRAGMA temp_store=MEMORY;')
+    conn.execute('PRAGMA cache_size=-65536;')  # ~64MB
+    return conn
+
+def _db_cache_version() -> str:
+    """Versão de cache baseada em mtime_ns e tamanho do banco e do seu arquivo -wal.
+    Em WAL as escritas ficam no -wal até o checkpoint, sem alterar o mtime do arquivo
+    principal; por isso os dois entram na chave que invalida o cache do Streamlit.
+    """
+    partes = []
+    for caminho in (DB_PATH, DB_PATH.with_name(DB_PATH.name + '-wal')):
+        try:
+            info = caminho.stat()
+            partes.append(f'{info.st_mtime_ns}-{info.st_size}')
+        except OSError:
+            partes.append('0-0')
+    return '_'.join(partes)
 
 @st.cache_data(ttl=3600)
-def get_data_bounds(_v: float) -> Tuple[str, str]:
+def get_data_bounds(v: str) -> Tuple[str, str]:
     """Busca a data mínima e máxima dos dados para o slider."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            row = pd.read_sql('SELECT MIN(data) AS min_d, MAX(data) AS max_d FROM dados_agregados', conn).iloc[0]
-            return (row['min_d'], row['max_d'])
+        conn = get_conn()
+        row = pd.read_sql('SELECT MIN(data) AS min_d, MAX(data) AS max_d FROM dados_agregados', conn).iloc[0]
+        return (row['min_d'], row['max_d'])
     except Exception:
         return ('2020-01', '2023-12') # Fallback
 
@@ -56,7 +114,7 @@ def carregar_projecoes_grupo(
     filtro_valor: str,
     grupo_tipo: str,
     grupos_valores: List[str],
-    _v: float,
+    v: str,
 ) -> pd.DataFrame:
     """Carrega séries reais e projetadas por grupo (tabela projecoes_salariais)."""
     if not grupos_valores:
@@ -71,19 +129,19 @@ def carregar_projecoes_grupo(
         ORDER BY data
     """
     params = [filtro_tipo, filtro_valor, grupo_tipo] + grupos_valores
-    with sqlite3.connect(DB_PATH) as conn:
-        df = pd.read_sql(query, conn, params=params)
+    conn = get_conn()
+    df = pd.read_sql(query, conn, params=params)
     if df.empty:
         return df
     df['data'] = pd.to_datetime(df['data'])
     return df
 
 @st.cache_data(ttl=3600)
-def carregar_regressao(_v: float) -> pd.DataFrame:
+def carregar_regressao(v: str) -> pd.DataFrame:
     """Carrega os coeficientes da regressão."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            df = pd.read_sql('SELECT * FROM coeficientes_regressao', conn)
+        conn = get_conn()
+        df = pd.read_sql('SELECT * FROM coeficientes_regressao', conn)
         df['coeficiente'] = (df['coeficiente'] * 100).round(2)
         df['p_valor'] = df['p_valor'].round(4)
         df = df.set_index('variavel')
@@ -92,32 +150,93 @@ def carregar_regressao(_v: float) -> pd.DataFrame:
         return pd.DataFrame()
 
 @st.cache_data(ttl=3600)
-def carregar_dados_historicos(data_ini: str, data_fim: str, _v: float) -> pd.DataFrame:
-    """Carrega SOMAS e calcula médias (contexto geral, sem filtros de município/CNAE)."""
-    sql = f'''
-        SELECT 
-            data, genero, raca_cor, grau_instrucao, "tipodedeficiência",
-            SUM(total_admissoes) AS total_admissoes,
-            SUM(soma_salario) AS soma_salario,
-            SUM(soma_idade) AS soma_idade
+def tem_dados_periodo(data_ini: str, data_fim: str, v: str) -> bool:
+    """Sonda barata: existe ao menos uma linha com admissões no período?"""
+    sql = '''
+        SELECT 1 FROM dados_agregados
+        WHERE data >= ? AND data <= ? AND total_admissoes > 0
+        LIMIT 1
+    '''
+    conn = get_conn()
+    return conn.execute(sql, [data_ini, data_fim]).fetchone() is not None
+
+@st.cache_data(ttl=3600)
+def colunas_dados(v: str) -> Tuple[str, ...]:
+    """Colunas de dados_agregados (bancos antigos não têm tipodedeficiência)."""
+    conn = get_conn()
+    return tuple(r[1] for r in conn.execute("PRAGMA table_info('dados_agregados')"))
+
+@st.cache_data(ttl=3600)
+def kpi_totais(data_ini: str, data_fim: str, v: str) -> Tuple[int, float]:
+    """Totais do período (admissões e soma salarial) agregados direto no SQLite."""
+    sql = '''
+        SELECT SUM(total_admissoes) AS total_admissoes, SUM(soma_salario) AS soma_salario
         FROM dados_agregados
-        WHERE data >= ? AND data <= ?
-        GROUP BY data, genero, raca_cor, grau_instrucao, "tipodedeficiência"
-        ORDER BY data
+        WHERE data >= ? AND data <= ? AND total_admissoes > 0
     '''
-    with sqlite3.connect(DB_PATH) as conn:
-        df = pd.read_sql(sql, conn, params=[data_ini, data_fim])
+    conn = get_conn()
+    row = conn.execute(sql, [data_ini, data_fim]).fetchone()
+    total, soma = row if row else (None, None)
+    return (int(total or 0), float(soma or 0.0))
 
-    df_validos = df[df['total_admissoes'] > 0].copy()
-    if df_validos.empty:
-        return pd.DataFrame()
+@st.cache_data(ttl=3600)
+def kpi_hiato(data_ini: str, data_fim: str, v: str) -> pd.DataFrame:
+    """Somas por gênero no período (uma linha por gênero), indexadas pelo nome amigável."""
+    sql = '''
+        SELECT genero,
+               SUM(soma_salario) AS soma_salario_total,
+               SUM(total_admissoes) AS total_admissoes_total
+        FROM dados_agregados
+        WHERE data >= ? AND data <= ? AND total_admissoes > 0
+        GROUP BY genero
+    '''
+    conn = get_conn()
+    df = pd.read_sql(sql, conn, params=[data_ini, data_fim])
+    df['genero_nome'] = df['genero'].astype(str).map(GENERO_MAP).fillna('Outro')
+    return df.set_index('genero_nome')
 
-    df_validos['salario_medio_ponderado'] = df_validos['soma_salario'] / df_validos['total_admissoes']
-    df_validos['idade_media_ponderada'] = df_validos['soma_idade'] / df_validos['total_admissoes']
-    df_validos['genero_nome'] = df_validos['genero'].astype(str).map(GENERO_MAP).fillna('Outro')
-    df_validos['raca_nome'] = df_validos['raca_cor'].astype(str).map(RACA_MAP).fillna('Outro')
-    df_validos['data'] = pd.to_datetime(df_validos['data'])
-    return df_validos
+@st.cache_data(ttl=3600)
+def kpi_bundle(data_ini: str, data_fim: str, v: str) -> Dict[str, Optional[float]]:
+    """KPIs prontos para exibição, memoizados por (período, versão do banco)."""
+    total_admissoes, soma_salario_geral = kpi_totais(data_ini, data_fim, v)
+    kpis: Dict[str, Optional[float]] = {
+        'total_admissoes': total_admissoes,
+        'salario_medio': soma_salario_geral / total_admissoes if total_admissoes else float('nan'),
+        'hiato': None,
+        'salario_homens': None,
+        'salario_mulheres': None,
+    }
+    try:
+        df_genero_kpi = kpi_hiato(data_ini, data_fim, v)
+        salario_homens_medio = df_genero_kpi.loc['Homem', 'soma_salario_total'] / df_genero_kpi.loc['Homem', 'total_admissoes_total']
+        salario_mulheres_medio = df_genero_kpi.loc['Mulher', 'soma_salario_total'] / df_genero_kpi.loc['Mulher', 'total_admissoes_total']
+        kpis['hiato'] = float((salario_mulheres_medio / salario_homens_medio) * 100)
+        kpis['salario_homens'] = float(salario_homens_medio)
+        kpis['salario_mulheres'] = float(salario_mulheres_medio)
+    except Exception as e:
+        logging.warning(f"Erro ao calcular KPI de hiato: {e}")
+    return kpis
+
+@st.cache_data(ttl=3600)
+def hist_por(dim: str, data_ini: str, data_fim: str, v: str) -> pd.DataFrame:
+    """Admissões por mês e por uma dimensão (ver HIST_DIMS), já agregadas no SQLite."""
+    col_sql, mapa = HIST_DIMS[dim]
+    sql = f'''
+        SELECT data, {col_sql} AS valor, SUM(total_admissoes) AS total_admissoes
+        FROM dados_agregados
+        WHERE data >= ? AND data <= ? AND total_admissoes > 0
+        GROUP BY data, {col_sql}
+        ORDER BY data
+    '''
+    conn = get_conn()
+    df = pd.read_sql(sql, conn, params=[data_ini, data_fim])
+    if mapa is not None:
+        # Códigos fora do mapa viram 'Outro' e precisam ser somados juntos
+        df['valor'] = df['valor'].astype(str).map(mapa).fillna('Outro')
+        df = df.groupby(['data', 'valor'], sort=False)['total_admissoes'].sum().reset_index()
+    df = df.rename(columns={'valor': dim})
+    df['data'] = pd.to_datetime(df['data'])
+    return df
 
 # --- LAYOUT PRINCIPAL DO DASHBOARD ---
 
@@ -142,41 +261,31 @@ except Exception as e:
     st.stop()
 
 # --- CARREGAMENTO DE DADOS HISTÓRICOS (Baseado na Sidebar) ---
-df_historico = carregar_dados_historicos(data_ini, data_fim, _db_cache_version())
+tem_historico = tem_dados_periodo(data_ini, data_fim, _db_cache_version())
 df_fatores = carregar_regressao(_db_cache_version())
 
 # --- CORPO PRINCIPAL (KPIs e TABS) ---
 st.header('Contexto geral (Brasil)')
 st.markdown(f"Período: **{data_ini}** a **{data_fim}**")
 
-if df_historico.empty:
+if not tem_historico:
     st.warning('Nenhum dado histórico encontrado para os filtros selecionados.')
     st.stop()
 
 # (CORRIGIDO v6) Cálculo de KPIs com base nas SOMAS
 kpi_col1, kpi_col2, kpi_col3 = st.columns(3)
-total_admissoes = int(df_historico['total_admissoes'].sum())
-kpi_col1.metric("Total de Admissões", f"{total_admissoes:,}".replace(',', '.'))
+kpis = kpi_bundle(data_ini, data_fim, _db_cache_version())
+kpi_col1.metric("Total de Admissões", f"{kpis['total_admissoes']:,}".replace(',', '.'))
 
-try:
-    df_genero_kpi = df_historico.groupby('genero_nome').agg(
-        soma_salario_total=('soma_salario', 'sum'),
-        total_admissoes_total=('total_admissoes', 'sum')
+if kpis['hiato'] is not None:
+    kpi_col2.metric(
+        "Hiato Salarial (M/H)", f"{kpis['hiato']:.1f}%",
+        f"{kpis['salario_mulheres']:,.2f} / {kpis['salario_homens']:,.2f}",
     )
-    
-    salario_homens_medio = df_genero_kpi.loc['Homem', 'soma_salario_total'] / df_genero_kpi.loc['Homem', 'total_admissoes_total']
-    salario_mulheres_medio = df_genero_kpi.loc['Mulher', 'soma_salario_total'] / df_genero_kpi.loc['Mulher', 'total_admissoes_total']
-    
-    hiato_atual = (salario_mulheres_medio / salario_homens_medio) * 100
-    kpi_col2.metric("Hiato Salarial (M/H)", f"{hiato_atual:.1f}%", f"{salario_mulheres_medio:,.2f} / {salario_homens_medio:,.2f}")
-
-except Exception as e:
-    logging.warning(f"Erro ao calcular KPI de hiato: {e}")
+else:
     kpi_col2.metric("Hiato Salarial (M/H)", "N/D")
 
-soma_salario_geral = df_historico['soma_salario'].sum()
-salario_medio_geral = soma_salario_geral / total_admissoes
-kpi_col3.metric("Salário Médio de Admissão", f"R$ {salario_medio_geral:,.2f}")
+kpi_col3.metric("Salário Médio de Admissão", f"R$ {kpis['salario_medio']:,.2f}")
 
 st.divider()
 
@@ -192,29 +301,17 @@ with tab_projecao:
     st.subheader('Projeções por Grupo (SARIMA)')
     filtro_tipo, filtro_valor = PROJECAO_PADRAO
     # Seleção de grupo
-    grupo_nomes = {
-        'Gênero': ('genero', {'MASC': 'Homens', 'FEM': 'Mulheres'}),
-        'Raça/Cor': ('raca_cor', {'BRANCA': 'Branca', 'PRETA': 'Preta', 'PARDA': 'Parda'}),
-        'Escolaridade': ('grau_instrucao', {
-            '1':'Analfabeto','2':'Fund. Incompl.','3':'Fund. Compl.','4':'Médio Incompl.','5':'Médio Compl.','6':'Sup. Incompl.','7':'Sup. Compl.','8':'Pós-grad.','9':'Mestrado','10':'Doutorado','11':'Pós-doc.'
-        }),
-        'Deficiência': ('tipodedeficiência', {
-            '0':'Não deficiente','1':'Física','2':'Auditiva','3':'Visual','4':'Intelectual','5':'Múltipla','6':'Reabilitado','9':'Não Identificado'
-        }),
-    }
-    grupo_tipo_nome = st.selectbox('Grupo', options=list(grupo_nomes.keys()))
-    grupo_tipo_sql, legenda = grupo_nomes[grupo_tipo_nome]
-    opcoes = list(legenda.keys())
+    grupo_tipo_nome = st.selectbox('Grupo', options=_GRUPO_TIPOS)
+    grupo_tipo_sql, legenda = _GRUPO_NOMES[grupo_tipo_nome]
+    opcoes = _GRUPO_OPCOES[grupo_tipo_nome]
     cols = st.columns(2)
     # Série A sempre disponível
     escolha1 = cols[0].selectbox('Série A', options=opcoes, index=0)
     # Série B: proteger contra lista vazia ao remover escolha1
     escolha2 = None
     if len(opcoes) >= 2:
-        opcoes_b = [o for o in opcoes if o != escolha1]
-        # Se por algum motivo a lista ficar vazia, recorre à lista original
-        if not opcoes_b:
-            opcoes_b = opcoes
+        # Já pré-calculado; se a lista ficasse vazia, recorre à lista original
+        opcoes_b = _OPCOES_B_BY_A[grupo_tipo_nome][escolha1]
         escolha2 = cols[1].selectbox('Série B', options=opcoes_b, index=0)
     else:
         cols[1].info('Só há uma categoria disponível para comparação.')
@@ -224,37 +321,61 @@ with tab_projecao:
     if df_grupos.empty:
         st.info('Sem projeções salvas para este grupo. Execute a modelagem para gerar projecoes_salariais.')
     else:
-        fig_cmp = go.Figure()
-        for cod in selecoes:
-            sub = df_grupos[df_grupos['grupo_valor'] == cod]
-            fig_cmp.add_trace(go.Scatter(x=sub['data'], y=sub['salario_real'], mode='lines+markers', name=f"{legenda.get(cod, cod)} (Real)", line=dict(color=PALETTE[0])))
-            sp = sub.dropna(subset=['salario_projetado'])
-            if not sp.empty:
-                fig_cmp.add_trace(go.Scatter(x=sp['data'], y=sp['salario_projetado_low'], mode='lines', line=dict(width=0), showlegend=False))
-                fig_cmp.add_trace(go.Scatter(x=sp['data'], y=sp['salario_projetado_high'], mode='lines', fill='tonexty', line=dict(width=0), name=f"{legenda.get(cod, cod)} (Intervalo)"))
-                fig_cmp.add_trace(go.Scatter(x=sp['data'], y=sp['salario_projetado'], mode='lines', line=dict(dash='dash'), name=f"{legenda.get(cod, cod)} (Proj.)"))
+        px, go = _plotly()
+        nomes_series = df_grupos['grupo_valor'].map(lambda c: legenda.get(c, c))
+        # Formato longo: real e projetado numa única chamada px.line (cor = série, traço = tipo)
+        df_long = (
+            df_grupos.assign(serie=nomes_series)
+            .melt(id_vars=['data', 'serie'], value_vars=['salario_real', 'salario_projetado'], var_name='tipo', value_name='valor')
+            .dropna(subset=['valor'])
+        )
+        df_long['tipo'] = df_long['tipo'].map({'salario_real': 'Real', 'salario_projetado': 'Proj.'})
+        # Cor fixa por série: linhas e banda do intervalo compartilham cor e grupo de legenda
+        cores = {serie: PALETTE[i % len(PALETTE)] for i, serie in enumerate(dict.fromkeys(nomes_series))}
+        fig_cmp = px.line(
+            df_long, x='data', y='valor', color='serie', line_dash='tipo', color_discrete_map=cores,
+            line_dash_map={'Real': 'solid', 'Proj.': 'dash'}, render_mode='webgl',
+        )
+        fig_cmp.update_traces(mode='lines+markers', selector=lambda t: t.name.endswith('Real'))
+        serie_por_cor = {cor: serie for serie, cor in cores.items()}
+        fig_cmp.for_each_trace(lambda t: t.update(legendgroup=serie_por_cor.get(t.line.color, t.legendgroup)))
+        # Intervalos de confiança: um polígono por série, adicionados de uma vez
+        sp = df_grupos.assign(serie=nomes_series).dropna(subset=['salario_projetado'])
+        bandas = [
+            go.Scatter(
+                x=pd.concat([g['data'], g['data'][::-1]]),
+                y=pd.concat([g['salario_projetado_high'], g['salario_projetado_low'][::-1]]),
+                fill='toself', mode='lines', line=dict(width=0, color=_rgba(cores[nome], 0.25)),
+                fillcolor=_rgba(cores[nome], 0.25), name=f"{nome} (Intervalo)",
+                legendgroup=nome, showlegend=False,
+            )
+            for nome, g in sp.groupby('serie', sort=False)
+        ]
+        if bandas:
+            fig_cmp.add_traces(bandas)
         fig_cmp.update_layout(title=f'Comparação de Séries ({grupo_tipo_nome})', yaxis_title='Salário Médio (R$)', xaxis_title='Data')
         st.plotly_chart(fig_cmp, use_container_width=True)
 
 # --- TAB 2: ANÁLISE HISTÓRICA (usa filtros da sidebar) ---
 with tab_historico:
     st.subheader('Evolução das Admissões')
+    px, _ = _plotly()
     col1, col2 = st.columns(2)
     # Gênero
-    df_genero_hist = df_historico.groupby(['data', 'genero_nome'])['total_admissoes'].sum().reset_index()
+    df_genero_hist = hist_por('genero_nome', data_ini, data_fim, _db_cache_version())
     fig_genero = px.bar(df_genero_hist, x='data', y='total_admissoes', color='genero_nome', barmode='group', labels={'total_admissoes':'Admissões','data':'Mês','genero_nome':'Gênero'})
     col1.plotly_chart(fig_genero, use_container_width=True)
     # Raça
-    df_raca_hist = df_historico.groupby(['data', 'raca_nome'])['total_admissoes'].sum().reset_index()
+    df_raca_hist = hist_por('raca_nome', data_ini, data_fim, _db_cache_version())
     fig_raca = px.bar(df_raca_hist, x='data', y='total_admissoes', color='raca_nome', barmode='stack', labels={'total_admissoes':'Admissões','data':'Mês','raca_nome':'Raça/Cor'})
     col2.plotly_chart(fig_raca, use_container_width=True)
     # Escolaridade
-    df_esc_hist = df_historico.groupby(['data', 'grau_instrucao'])['total_admissoes'].sum().reset_index()
+    df_esc_hist = hist_por('grau_instrucao', data_ini, data_fim, _db_cache_version())
     fig_esc = px.bar(df_esc_hist, x='data', y='total_admissoes', color='grau_instrucao', barmode='stack', labels={'total_admissoes':'Admissões','data':'Mês','grau_instrucao':'Escolaridade'})
     st.plotly_chart(fig_esc, use_container_width=True)
     # Deficiência (se existir)
-    if 'tipodedeficiência' in df_historico.columns:
-        df_def_hist = df_historico.groupby(['data', 'tipodedeficiência'])['total_admissoes'].sum().reset_index()
+    if 'tipodedeficiência' in colunas_dados(_db_cache_version()):
+        df_def_hist = hist_por('tipodedeficiência', data_ini, data_fim, _db_cache_version())
         fig_def = px.bar(df_def_hist, x='data', y='total_admissoes', color='tipodedeficiência', barmode='stack', labels={'total_admissoes':'Admissões','data':'Mês','tipodedeficiência':'Deficiência'})
         st.plotly_chart(fig_def, use_container_width=True)
 
@@ -264,21 +385,19 @@ with tab_fatores:
     if df_fatores.empty:
         st.info('Nenhum resultado de regressão disponível. (Execute modelagem.py)')
     else:
+        px, _ = _plotly()
         # Helper para construir gráfico por categoria a partir da tabela de coeficientes
         def grafico_por_categoria(prefixo: str, categorias: Dict[str, str], titulo: str):
-            rows = []
             # Definimos como base a menor chave por ordem natural; as demais buscam dummy "prefixo_codigo"
             base = sorted(categorias.keys(), key=lambda x: (len(x), x))[0]
-            for cod, nome in categorias.items():
-                if cod == base:
-                    coef = 0.0
-                    pval = None
-                else:
-                    var = f'{prefixo}_{cod}'
-                    coef = float(df_fatores.loc[var, 'coeficiente']) if var in df_fatores.index else 0.0
-                    pval = float(df_fatores.loc[var, 'p_valor']) if var in df_fatores.index else None
-                rows.append({'categoria': nome, 'impacto_pct': round(coef, 2), 'p_valor': pval})
-            dfx = pd.DataFrame(rows).sort_values('impacto_pct')
+            outras = [cod for cod in categorias if cod != base]
+            # Um único reindex traz coeficiente e p-valor de todas as dummies (ausentes -> NaN)
+            sub = df_fatores.reindex([f'{prefixo}_{cod}' for cod in outras])
+            dfx = pd.DataFrame({
+                'categoria': [categorias[base]] + [categorias[cod] for cod in outras],
+                'impacto_pct': np.concatenate(([0.0], sub['coeficiente'].fillna(0.0).round(2).to_numpy(dtype=float))),
+                'p_valor': np.concatenate(([np.nan], sub['p_valor'].to_numpy(dtype=float))),
+            }).sort_values('impacto_pct')
             fig = px.bar(dfx, x='impacto_pct', y='categoria', orientation='h',
                          color=(dfx['p_valor'].fillna(1.0) < 0.05),
                          color_discrete_map={True: PRIMARY, False: '#BBBBBB'},
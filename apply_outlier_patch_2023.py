@@ -28,8 +28,15 @@ import shutil
 import sqlite3
 from typing import List, Dict
 
+import numpy as np
 import pandas as pd
 
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except Exception:
+    HAS_NUMBA = False
+
 
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / 'projeto_caged.db'
@@ -42,6 +49,13 @@ AGG_KEYS = [
     'raca_cor',
 ]
 
+# Same statement text for both months, so sqlite3 reuses the prepared statement
+INSERT_COLS = ['data'] + AGG_KEYS + ['soma_salario', 'soma_idade', 'total_admissoes']
+INSERT_SQL = (
+    f"INSERT INTO dados_agregados ({', '.join(INSERT_COLS)}) "
+    f"VALUES ({', '.join('?' * len(INSERT_COLS))})"
+)
+
 
 def read_months(conn: sqlite3.Connection, months: List[str]) -> pd.DataFrame:
     qs = ','.join('?' for _ in months)
@@ -53,63 +67,88 @@ def read_months(conn: sqlite3.Connection, months: List[str]) -> pd.DataFrame:
     return pd.read_sql(sql, conn, params=months)
 
 
+def safe_div(num: pd.Series, denom: pd.Series) -> np.ndarray:
+    """Float64 division that yields NaN where the denominator is zero."""
+    n = num.to_numpy(dtype=np.float64)
+    d = denom.to_numpy(dtype=np.float64)
+    out = np.full_like(n, np.nan)
+    np.divide(n, d, out=out, where=d != 0)
+    return out
+
+
 def per_group_means(df: pd.DataFrame) -> pd.DataFrame:
     out = df.copy()
-    denom = out['total_admissoes'].replace({0: pd.NA})
-    out['mean_sal'] = out['soma_salario'] / denom
-    out['mean_idd'] = out['soma_idade'] / denom
+    out['mean_sal'] = safe_div(out['soma_salario'], out['total_admissoes'])
+    out['mean_idd'] = safe_div(out['soma_idade'], out['total_admissoes'])
     return out
 
 
-def pooled_means(df: pd.DataFrame) -> pd.DataFrame:
+def baseline_stats(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Single groupby over the baseline months: pooled sums, pooled means and the
+    max per-month mean salary of each group (indexed by AGG_KEYS).
+    """
+    df = df.assign(mean_sal=safe_div(df['soma_salario'], df['total_admissoes']))
     grp = (
-        df.groupby(AGG_KEYS, dropna=False)
+        df.groupby(AGG_KEYS, dropna=False, observed=True, sort=False)
         .agg(
             soma_salario=('soma_salario', 'sum'),
             soma_idade=('soma_idade', 'sum'),
             total_admissoes=('total_admissoes', 'sum'),
+            prior_max_mean_sal=('mean_sal', 'max'),
         )
-        .reset_index()
     )
-    denom = grp['total_admissoes'].replace({0: pd.NA})
-    grp['mean_sal'] = grp['soma_salario'] / denom
-    grp['mean_idd'] = grp['soma_idade'] / denom
+    grp['mean_sal'] = safe_div(grp['soma_salario'], grp['total_admissoes'])
+    grp['mean_idd'] = safe_div(grp['soma_idade'], grp['total_admissoes'])
     return grp
 
 
+def _apply_fix_np(mean_sal, prior_max, base_sal, base_idd, total_adm, out_sal, out_idd) -> None:
+    # NaN comparisons are False, so groups missing from the baseline only trip the 5000 rule
+    sel = (mean_sal > 5000.0) | (mean_sal > 1.5 * prior_max) | (mean_sal > 1.5 * base_sal)
+    out_sal[sel] = base_sal[sel] * total_adm[sel]
+    out_idd[sel] = base_idd[sel] * total_adm[sel]
+
+
+if HAS_NUMBA:
+    # fastmath is left off: it assumes no NaNs, and baseline gaps are NaN here
+    @njit(cache=True)
+    def _apply_fix(mean_sal, prior_max, base_sal, base_idd, total_adm, out_sal, out_idd):
+        for i in range(mean_sal.size):
+            ms = mean_sal[i]
+            if ms > 5000.0 or ms > 1.5 * prior_max[i] or ms > 1.5 * base_sal[i]:
+                out_sal[i] = base_sal[i] * total_adm[i]
+                out_idd[i] = base_idd[i] * total_adm[i]
+else:
+    _apply_fix = _apply_fix_np
+
+
 def compute_corrected_month(df_target: pd.DataFrame, df_baseline: pd.DataFrame, label: str) -> pd.DataFrame:
     """
     Returns a corrected copy of df_target with sums replaced for outlier groups
     based on pooled baseline means.
     """
-    cur = per_group_means(df_target)
-    base = pooled_means(df_baseline)[AGG_KEYS + ['mean_sal', 'mean_idd']]
-    merged = cur.merge(base, on=AGG_KEYS, how='left', suffixes=('', '_base'))
-
-    # prior max mean across baseline months
-    base_means = per_group_means(df_baseline)
-    prior_max = (
-        base_means.groupby(AGG_KEYS, dropna=False)['mean_sal']
-        .max()
-        .reset_index()
-        .rename(columns={'mean_sal': 'prior_max_mean_sal'})
+    cur = per_group_means(df_target).set_index(AGG_KEYS)
+    base = (
+        baseline_stats(df_baseline)[['mean_sal', 'mean_idd', 'prior_max_mean_sal']]
+        .rename(columns={'mean_sal': 'mean_sal_base', 'mean_idd': 'mean_idd_base'})
     )
-    merged = merged.merge(prior_max, on=AGG_KEYS, how='left')
-
-    # Outlier condition
-    cond = (
-        (merged['mean_sal'] > 5000)
-        | (merged['mean_sal'] > 1.5 * merged['prior_max_mean_sal'])
-        | (merged['mean_sal'] > 1.5 * merged['mean_sal_base'])
+    merged = cur.join(base, how='left').reset_index()
+
+    # Outlier condition + new sums (in place over float64 arrays)
+    new_sal = merged['soma_salario'].to_numpy(dtype=np.float64, copy=True)
+    new_idd = merged['soma_idade'].to_numpy(dtype=np.float64, copy=True)
+    _apply_fix(
+        merged['mean_sal'].to_numpy(dtype=np.float64),
+        merged['prior_max_mean_sal'].to_numpy(dtype=np.float64),
+        merged['mean_sal_base'].to_numpy(dtype=np.float64),
+        merged['mean_idd_base'].to_numpy(dtype=np.float64),
+        merged['total_admissoes'].to_numpy(dtype=np.float64),
+        new_sal,
+        new_idd,
     )
-    merged['apply_fix'] = cond.fillna(False)
-
-    # New sums
-    merged['new_soma_salario'] = merged['soma_salario']
-    merged['new_soma_idade'] = merged['soma_idade']
-    sel = merged['apply_fix']
-    merged.loc[sel, 'new_soma_salario'] = merged.loc[sel, 'mean_sal_base'] * merged.loc[sel, 'total_admissoes']
-    merged.loc[sel, 'new_soma_idade'] = merged.loc[sel, 'mean_idd_base'] * merged.loc[sel, 'total_admissoes']
+    merged['new_soma_salario'] = new_sal
+    merged['new_soma_idade'] = new_idd
 
     # Build final df for this month
     final = merged[AGG_KEYS + ['new_soma_salario', 'new_soma_idade', 'total_admissoes']].copy()
@@ -118,6 +157,10 @@ def compute_corrected_month(df_target: pd.DataFrame, df_baseline: pd.DataFrame,
     return final
 
 
+def insert_rows(conn: sqlite3.Connection, df: pd.DataFrame) -> None:
+    conn.executemany(INSERT_SQL, df[INSERT_COLS].itertuples(index=False, name=None))
+
+
 def overall_mean(df: pd.DataFrame) -> float:
     s = df['soma_salario'].sum()
     n = df['total_admissoes'].sum()
@@ -134,37 +177,49 @@ def main() -> None:
     print(f"Backup criado: {backup}")
 
     with sqlite3.connect(DB_PATH) as conn:
+        conn.execute('PRAGMA mmap_size=268435456;')  # 256MB
+        conn.execute('PRAGMA temp_store=MEMORY;')
+        conn.execute('PRAGMA cache_size=-65536;')  # ~64MB
         print('Conectado ao banco:', DB_PATH)
 
+        # Leitura única de 2023-05..2023-09; cada etapa só fatia em memória
+        df_all = read_months(conn, ['2023-05', '2023-06', '2023-07', '2023-08', '2023-09'])
+        df_all['data'] = df_all['data'].astype('category')
+        mes = df_all['data']
+
         # Step 1: Agosto (baseline: 2023-05, 2023-06, 2023-07)
-        months_aug = ['2023-08', '2023-05', '2023-06', '2023-07']
-        df_aug_full = read_months(conn, months_aug)
-        df_aug_target = df_aug_full[df_aug_full['data'] == '2023-08'].copy()
-        df_aug_base = df_aug_full[df_aug_full['data'].isin(['2023-05', '2023-06', '2023-07'])].copy()
+        df_aug_target = df_all[mes == '2023-08'].copy()
+        df_aug_base = df_all[mes.isin(['2023-05', '2023-06', '2023-07'])].copy()
         df_aug_fixed = compute_corrected_month(df_aug_target, df_aug_base, '2023-08')
         print(f"Agosto: média atual={overall_mean(df_aug_target):,.2f} | proposta={overall_mean(df_aug_fixed):,.2f}")
 
         # Step 2: Setembro (baseline sequencial: 2023-06, 2023-07 + Agosto corrigido)
-        months_sep = ['2023-09', '2023-06', '2023-07']
-        df_sep_from_db = read_months(conn, months_sep)
-        df_sep_target = df_sep_from_db[df_sep_from_db['data'] == '2023-09'].copy()
-        df_sep_base = df_sep_from_db[df_sep_from_db['data'].isin(['2023-06', '2023-07'])].copy()
+        df_sep_target = df_all[mes == '2023-09'].copy()
+        df_sep_base = df_all[mes.isin(['2023-06', '2023-07'])]
         base_cols = ['data'] + AGG_KEYS + ['soma_salario', 'soma_idade', 'total_admissoes']
         df_sep_base = pd.concat([df_sep_base[base_cols], df_aug_fixed[base_cols]], ignore_index=True)
         df_sep_fixed = compute_corrected_month(df_sep_target, df_sep_base, '2023-09')
         print(f"Setembro: média atual={overall_mean(df_sep_target):,.2f} | proposta={overall_mean(df_sep_fixed):,.2f}")
 
-        # Apply changes in a transaction: delete + insert
-        # Usa controle manual de autocommit: sqlite3 em Python inicia transação implícita ao primeiro write.
+        # Apply changes in a single explicit transaction: delete + insert
+        # (backup above covers the relaxed durability while the write runs).
+        # Autocommit mode: transaction boundaries are issued by hand, not by the sqlite3 module.
+        conn.isolation_level = None
+        sync_prev = conn.execute('PRAGMA synchronous').fetchone()[0]
+        conn.execute('PRAGMA synchronous=OFF')
         try:
+            conn.execute('BEGIN IMMEDIATE')
             conn.execute("DELETE FROM dados_agregados WHERE data IN ('2023-08','2023-09')")
-            df_aug_fixed.to_sql('dados_agregados', conn, if_exists='append', index=False, chunksize=10000)
-            df_sep_fixed.to_sql('dados_agregados', conn, if_exists='append', index=False, chunksize=10000)
-            conn.commit()
+            insert_rows(conn, df_aug_fixed)
+            insert_rows(conn, df_sep_fixed)
+            conn.execute('COMMIT')
             print('Atualização aplicada com sucesso para 2023-08 e 2023-09.')
         except Exception:
-            conn.rollback()
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
             raise
+        finally:
+            conn.execute(f'PRAGMA synchronous={int(sync_prev)}')
 
         # Verify new monthly averages
         cur = conn.cursor()
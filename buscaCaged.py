@@ -1,56 +1,203 @@
 from ftplib import FTP
+import asyncio
 import ftplib
+import json
 import os
+import random
+import socket
 import time
-import subprocess
+
+try:
+    import aioftp
+    HAS_AIOFTP = True
+except Exception:
+    HAS_AIOFTP = False
 
 # Configurações
 ftp_server = 'ftp.mtps.gov.br'
 ftp_directory = '/pdet/microdados/NOVO CAGED'
-local_year_month_file = 'anos_meses_registrados.txt'
+local_year_month_file = 'anos_meses_registrados.json'
+legacy_year_month_file = 'anos_meses_registrados.txt'  # Formato antigo "ano - m1,m2", lido só para migração
 log_file = 'log_BuscaCaged.txt'
 download_directory = 'CAGEDMOV_downloads'  # Diretório onde os arquivos serão salvos
-retry_interval = 10  # Tempo em segundos antes de tentar novamente em caso de falha
+max_tentativas = 8  # Tentativas de conexão antes de desistir
+backoff_base = 1  # Espera (s) da primeira nova tentativa; dobra a cada falha
+backoff_max = 60  # Teto da espera (s) entre tentativas
+timeout_socket = 60  # Canais de controle/dados travados falham após esse tempo (s)
+max_conexoes = 8  # Conexões FTP paralelas para download (aioftp)
+checkpoint_meses = 6  # Grava o registro a cada N meses baixados (e sempre ao final da execução)
 
 def registrar_log(mensagem):
     with open(log_file, 'a') as f:
         f.write(mensagem + '\n')
 
 def obter_anos_meses_registrados(file_path):
-    if not os.path.exists(file_path):
-        if file_path == local_year_month_file:
-            registrar_log("Arquivo de anos e meses registrados não encontrado. Criando um novo.")
-        return {}
-    with open(file_path, 'r') as f:
-        data = {}
-        for line in f:
-            year, months = line.strip().split(' - ')
-            data[year] = months.split(',')
-        return data
+    if os.path.exists(file_path):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    if file_path == local_year_month_file and os.path.exists(legacy_year_month_file):
+        # Migração do registro em texto; o próximo salvamento já grava o JSON
+        with open(legacy_year_month_file, 'r') as f:
+            data = {}
+            for line in f:
+                year, months = line.strip().split(' - ')
+                data[year] = [m for m in months.split(',') if m]
+            return data
+    if file_path == local_year_month_file:
+        registrar_log("Arquivo de anos e meses registrados não encontrado. Criando um novo.")
+    return {}
 
 def salvar_ano_mes_registrado(file_path, data):
-    with open(file_path, 'w') as f:
-        for year, months in data.items():
-            months_str = ','.join(months)
-            f.write(f"{year} - {months_str}\n")
-
-# Função para criar o diretório de download, se não existir
-os.makedirs(download_directory, exist_ok=True)
-if not os.path.exists(log_file):
-    registrar_log("Diretorio: CAGEDMOV_downloads não foi encontrado, criarei em minha raiz uma pasta com este mesmo nome")
-
-# Tentativas de conexão
-while True:
+    global meses_nao_salvos
+    # Escreve num temporário e troca com os.replace (atômico): um crash nunca deixa o registro pela metade
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, sort_keys=True, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+    meses_nao_salvos = 0
+
+# Meses registrados em memória desde o último salvamento
+meses_nao_salvos = 0
+
+# Cache das listagens (NLST) por caminho absoluto: cada diretório é listado uma vez por execução.
+# O script não grava nem apaga nada no servidor, então o cache não precisa de invalidação.
+listings: dict[str, list[str]] = {}
+
+# Arquivos já presentes em download_directory (preenchido uma vez em main)
+arquivos_locais: set[str] = set()
+
+def listar_diretorio(ftp, path):
+    if path not in listings:
+        ftp.cwd(path)
+        listings[path] = ftp.nlst()
+    return listings[path]
+
+def listar_meses(ftp, ano):
+    nomes = listar_diretorio(ftp, f"{ftp_directory}/{ano}")
+    return sorted(name[4:] for name in nomes if name.isdigit() and len(name) == 6 and name.startswith(ano))
+
+def listar_arquivos_caged(ftp, ano, mes):
+    nomes = listar_diretorio(ftp, f"{ftp_directory}/{ano}/{ano}{mes}")
+    return [arq for arq in nomes if arq.startswith('CAGEDMOV')]
+
+def registrar_mes_baixado(anos_meses_registrados, ano, mes):
+    # Chamado só depois que todos os arquivos do mês foram baixados (ou quando o mês não tem arquivos)
+    global meses_nao_salvos
+    if ano not in anos_meses_registrados:
+        registrar_log(f"Novo ano {ano} adicionado ao registro.")
+    meses = anos_meses_registrados.setdefault(ano, [])
+    if mes not in meses:
+        meses.append(mes)
+        meses_nao_salvos += 1
+        registrar_log(f"Mês {ano}{mes} adicionado ao registro.")
+        # Um mês perdido num crash só é rebaixado em parte: arquivos já existentes são pulados
+        if meses_nao_salvos >= checkpoint_meses:
+            salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
+
+async def baixar_arquivo_async(ano, mes, arquivo_cagedmov, sem):
+    local_file_path = os.path.join(download_directory, arquivo_cagedmov)
+    # Evita download duplicado
+    if arquivo_cagedmov in arquivos_locais:
+        registrar_log(f"Arquivo já existe, pulando: {arquivo_cagedmov}")
+        return
+    # Um aioftp.Client por download: o cliente não multiplexa transferências
+    async with sem:
+        registrar_log(f"Baixando: {arquivo_cagedmov} -> {local_file_path}")
+        try:
+            async with aioftp.Client.context(ftp_server, socket_timeout=timeout_socket) as client:
+                await client.change_directory(f"{ftp_directory}/{ano}/{ano}{mes}")
+                await client.download(arquivo_cagedmov, local_file_path, write_into=True)
+        except BaseException:
+            # Arquivo parcial seria pulado como "já existe" na próxima execução
+            if os.path.exists(local_file_path):
+                os.remove(local_file_path)
+            raise
+    arquivos_locais.add(arquivo_cagedmov)
+    registrar_log(f"Arquivo {arquivo_cagedmov} baixado com sucesso para {local_file_path}.")
+
+async def baixar_mes_async(ano, mes, arquivos_caged, sem, anos_meses_registrados):
+    await asyncio.gather(*(baixar_arquivo_async(ano, mes, arq, sem) for arq in arquivos_caged))
+    # Registra o mês só depois que todos os arquivos dele terminaram (mantém a retomada)
+    registrar_mes_baixado(anos_meses_registrados, ano, mes)
+
+async def baixar_pendentes_async(pendentes, anos_meses_registrados):
+    sem = asyncio.Semaphore(max_conexoes)
+    resultados = await asyncio.gather(
+        *(baixar_mes_async(ano, mes, arquivos, sem, anos_meses_registrados) for ano, mes, arquivos in pendentes),
+        return_exceptions=True,
+    )
+    for (ano, mes, _), res in zip(pendentes, resultados):
+        if isinstance(res, Exception):
+            registrar_log(f"Erro ao baixar arquivos de {ano}{mes}: {res}")
+
+def baixar_pendentes_ftplib(ftp, pendentes, anos_meses_registrados):
+    # Fallback sequencial (sem aioftp) usando a conexão de listagem
+    for ano, mes, arquivos_caged in pendentes:
+        try:
+            ftp.cwd(f"{ftp_directory}/{ano}/{ano}{mes}")
+            for arquivo_cagedmov in arquivos_caged:
+                local_file_path = os.path.join(download_directory, arquivo_cagedmov)
+                if arquivo_cagedmov in arquivos_locais:
+                    registrar_log(f"Arquivo já existe, pulando: {arquivo_cagedmov}")
+                    continue
+                registrar_log(f"Baixando: {arquivo_cagedmov} -> {local_file_path}")
+                try:
+                    with open(local_file_path, 'wb') as local_file:
+                        ftp.retrbinary(f'RETR {arquivo_cagedmov}', local_file.write)
+                except BaseException:
+                    # Arquivo parcial seria pulado como "já existe" na próxima execução
+                    os.remove(local_file_path)
+                    raise
+                arquivos_locais.add(arquivo_cagedmov)
+                registrar_log(f"Arquivo {arquivo_cagedmov} baixado com sucesso para {local_file_path}.")
+        except ftplib.all_errors as e:
+            # Mês fica fora do registro e volta à fila na próxima execução
+            registrar_log(f"Erro ao baixar arquivos de {ano}{mes}: {e}")
+            continue
+        registrar_mes_baixado(anos_meses_registrados, ano, mes)
+
+def conectar_ftp():
+    # Backoff exponencial com jitter; só conexão/login são repetidos
+    for tentativa in range(max_tentativas):
+        try:
+            ftp = FTP(ftp_server)
+            ftp.login()
+            ftp.set_pasv(True)
+            return ftp
+        except (ConnectionRefusedError, ftplib.error_temp, socket.timeout, EOFError) as e:
+            if tentativa == max_tentativas - 1:
+                registrar_log(f"Erro de conexão: {e}. Desistindo após {max_tentativas} tentativas.")
+                break
+            delay = min(backoff_base * 2 ** tentativa, backoff_max)
+            registrar_log(f"Erro de conexão: {e}. Tentativa {tentativa + 1}/{max_tentativas}; nova tentativa em {delay} segundos.")
+            time.sleep(delay + random.uniform(0, delay * 0.1))
+    return None
+
+def encerrar_ftp(ftp):
     try:
-        # Conectar ao FTP
-        ftp = FTP(ftp_server)
-        ftp.login()
-        ftp.set_pasv(True)
+        ftp.quit()
+    except Exception:
+        ftp.close()
+
+def main():
+    socket.setdefaulttimeout(timeout_socket)
+
+    # Função para criar o diretório de download, se não existir
+    os.makedirs(download_directory, exist_ok=True)
+    # Um único readdir no início; os downloads vão sendo acrescentados ao conjunto
+    arquivos_locais.update(os.listdir(download_directory))
+    if not os.path.exists(log_file):
+        registrar_log("Diretorio: CAGEDMOV_downloads não foi encontrado, criarei em minha raiz uma pasta com este mesmo nome")
 
-        # Verificar o caminho FTP atual e listar diretórios
+    # Conectar ao FTP (com novas tentativas)
+    ftp = conectar_ftp()
+    if ftp is None:
+        return
+
+    try:
         print("Diretório atual:", ftp.pwd())
-        print("Listando diretórios:")
-        ftp.retrlines('LIST')
 
         # Mudar para o diretório desejado
         try:
@@ -58,155 +205,76 @@ while True:
         except ftplib.error_perm as e:
             registrar_log(f"Erro ao mudar para o diretório {ftp_directory}: {e}")
             ftp.quit()
-            exit()
+            return
 
         # Obter lista de anos no diretório
         try:
             ftp.encoding = 'latin-1'
-            anos_disponiveis = [name for name in ftp.nlst() if name.isdigit() and len(name) == 4]
+            anos_disponiveis = [name for name in listar_diretorio(ftp, ftp_directory) if name.isdigit() and len(name) == 4]
             anos_disponiveis.sort()
-            print("Diretório atual:", ftp.pwd())
-            print("Listando diretórios:")
-            ftp.retrlines('LIST')
         except UnicodeDecodeError as e:
             registrar_log(f"Erro ao listar anos disponíveis: {e}")
             ftp.quit()
-            exit()
+            return
 
         # Verificar anos e meses registrados
         anos_meses_registrados = obter_anos_meses_registrados(local_year_month_file)
-        novo_ano_encontrado = False
-        ano_selecionado = None
+        pendentes = []  # (ano, mes, arquivos_caged) baixados em paralelo após a listagem
 
+        # Passada única por (ano, mês): todo mês ainda não registrado entra na fila de download
+        # O registro só muda depois do download (registrar_mes_baixado): uma falha não marca meses não baixados
         for ano in anos_disponiveis:
-            if ano not in anos_meses_registrados:
-                anos_meses_registrados[ano] = []  # Adiciona o novo ano
+            novo_ano = ano not in anos_meses_registrados
+            if novo_ano:
                 registrar_log(f"Novo ano encontrado: {ano}")
-                ftp.cwd(ano)
-                meses_disponiveis = [name[4:] for name in ftp.nlst() if name.isdigit() and len(name) == 6 and name.startswith(ano)]
-                meses_disponiveis.sort()
-                for mes in meses_disponiveis:
-                    ftp.cwd(f"{ano}{mes}")
-                    arquivos = ftp.nlst()
-                    arquivos_caged = [arq for arq in arquivos if arq.startswith('CAGEDMOV')]
-                    if arquivos_caged:
-                        registrar_log(f"Novo ano encontrado, e mês {mes} contém {len(arquivos_caged)} arquivo(s) CAGED.")
-                        for arquivo_cagedmov in arquivos_caged:
-                            local_file_path = os.path.join(download_directory, arquivo_cagedmov)
-                            # Evita download duplicado
-                            if os.path.exists(local_file_path):
-                                registrar_log(f"Arquivo já existe, pulando: {arquivo_cagedmov}")
-                                continue
-                            registrar_log(f"Baixando: {arquivo_cagedmov} -> {local_file_path}")
-                            with open(local_file_path, 'wb') as local_file:
-                                ftp.retrbinary(f'RETR {arquivo_cagedmov}', local_file.write)
-                            registrar_log(f"Arquivo {arquivo_cagedmov} baixado com sucesso para {local_file_path}.")
-                        # Atualizar o registro de meses após baixar todos
-                        if mes not in anos_meses_registrados[ano]:
-                            anos_meses_registrados[ano].append(mes)
-                            salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
-                    else:
-                        registrar_log(f"Novo ano encontrado, mas o mês {mes} não continha nenhum arquivo CAGED.")
-                    ftp.cwd("..")
-                anos_meses_registrados[ano] = meses_disponiveis
-                salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
-                novo_ano_encontrado = True
-                ano_selecionado = ano
-                registrar_log(f"Novo ano {ano} e meses adicionados: {','.join(meses_disponiveis)}")
-                ftp.cwd("..")
-            else:
-                ftp.cwd(f"{ano}")
-                meses_disponiveis = [name[4:] for name in ftp.nlst() if name.isdigit() and len(name) == 6 and name.startswith(ano)]
-                meses_disponiveis.sort()
-                meses_registrados = set(anos_meses_registrados[ano])
-                novos_meses = [mes for mes in meses_disponiveis if mes not in meses_registrados]    
-                for mes in novos_meses:
-                    ftp.cwd(f"{ano}{mes}")
-                    arquivos = ftp.nlst()
-                    arquivos_caged = [arq for arq in arquivos if arq.startswith('CAGEDMOV')]
-                    if arquivos_caged:
-                        registrar_log(f"Novos meses encontrados, e mês {mes} contém {len(arquivos_caged)} arquivo(s) CAGED.")
-                        for arquivo_cagedmov in arquivos_caged:
-                            local_file_path = os.path.join(download_directory, arquivo_cagedmov)
-                            if os.path.exists(local_file_path):
-                                registrar_log(f"Arquivo já existe, pulando: {arquivo_cagedmov}")
-                                continue
-                            registrar_log(f"Baixando: {arquivo_cagedmov} -> {local_file_path}")
-                            with open(local_file_path, 'wb') as local_file:
-                                ftp.retrbinary(f'RETR {arquivo_cagedmov}', local_file.write)
-                            registrar_log(f"Arquivo {arquivo_cagedmov} baixado com sucesso para {local_file_path}.")
-                        # Atualiza registro após baixar todos os arquivos do mês
-                        anos_meses_registrados[ano].append(mes)
-                        salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
-                    else:
-                        registrar_log(f"Novo ano encontrado, mas o mês {mes} não continha nenhum arquivo CAGED.")
-                    ftp.cwd("..")
-
-                ftp.cwd("..")
-
-            if novo_ano_encontrado:
-                break
-
-        if not novo_ano_encontrado:
-            ano_selecionado = max(anos_meses_registrados.keys(), key=int)
+            meses_disponiveis = listar_meses(ftp, ano)
+            meses_registrados = set(anos_meses_registrados.get(ano, []))
+            novos_meses = [mes for mes in meses_disponiveis if mes not in meses_registrados]
+            for mes in novos_meses:
+                arquivos_caged = listar_arquivos_caged(ftp, ano, mes)
+                if arquivos_caged:
+                    registrar_log(f"Mês {ano}{mes} contém {len(arquivos_caged)} arquivo(s) CAGED.")
+                    # Download agendado; o mês é registrado quando terminar
+                    pendentes.append((ano, mes, arquivos_caged))
+                elif novo_ano:
+                    registrar_log(f"Novo ano encontrado, mas o mês {mes} não continha nenhum arquivo CAGED.")
+                    registrar_mes_baixado(anos_meses_registrados, ano, mes)  # Nada a baixar
+                else:
+                    registrar_log(f"Mês {ano}{mes} não continha nenhum arquivo CAGED.")
 
-        # Selecionar o último mês registrado ou o mais recente
-        ultimo_mes_registrado = max(anos_meses_registrados[ano_selecionado], key=int)
-        ftp.cwd(ano_selecionado)
+        if not pendentes:
+            registrar_log("Nenhum mês novo encontrado. Registro já está atualizado.")
 
-        meses_disponiveis = [name[4:] for name in ftp.nlst() if name.isdigit() and len(name) == 6 and name.startswith(ano_selecionado)]
-        meses_disponiveis.sort()
+        # Downloads: paralelos via aioftp (N conexões) ou sequenciais pela conexão atual
+        if pendentes and not HAS_AIOFTP:
+            registrar_log("aioftp indisponível. Baixando sequencialmente com ftplib.")
+            baixar_pendentes_ftplib(ftp, pendentes, anos_meses_registrados)
 
-        mes_mais_recente = max(meses_disponiveis, key=int) if meses_disponiveis else None
-        print(f"mes: {mes_mais_recente}")
-        if not mes_mais_recente:
-            registrar_log(f"Nenhum mês disponível para o ano {ano_selecionado}.")
-            ftp.quit()
-            exit()
-
-        if mes_mais_recente in anos_meses_registrados[ano_selecionado]:
-            registrar_log(f"Mês {mes_mais_recente} já está atualizado.")
-        else:
-            registrar_log(f"Novo mês encontrado: {mes_mais_recente}. Iniciando download.")
-            ftp.cwd(f"{ano_selecionado}{mes_mais_recente}")
-
-            # Baixar o arquivo CAGEDMOV
-            arquivos = ftp.nlst()
-            arquivos_caged = [arq for arq in arquivos if arq.startswith('CAGEDMOV')]
-
-            if arquivos_caged:
-                for arquivo_cagedmov in arquivos_caged:
-                    local_file_path = os.path.join(download_directory, arquivo_cagedmov)
-                    if os.path.exists(local_file_path):
-                        registrar_log(f"Arquivo já existe, pulando: {arquivo_cagedmov}")
-                        continue
-                    registrar_log(f"Tentando baixar o arquivo: {arquivo_cagedmov} para o caminho: {local_file_path}")
-                    with open(local_file_path, 'wb') as local_file:
-                        ftp.retrbinary(f'RETR {arquivo_cagedmov}', local_file.write)
-                    registrar_log(f"Arquivo {arquivo_cagedmov} baixado com sucesso para {local_file_path}.")
-                # Atualizar o registro de meses após o download bem-sucedido
-                if mes_mais_recente not in anos_meses_registrados[ano_selecionado]:
-                    anos_meses_registrados[ano_selecionado].append(mes_mais_recente)
-                    salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
-            else:
-                registrar_log("Nenhum arquivo CAGEDMOV encontrado no diretório.")
-
-        # Fechar a conexão FTP
+        # Fechar a conexão FTP (a de listagem não fica ociosa durante os downloads paralelos)
         ftp.quit()
-        # Tentar chamar o script converterCSV.py
+        if pendentes and HAS_AIOFTP:
+            registrar_log(f"Iniciando download paralelo de {len(pendentes)} mês(es).")
+            asyncio.run(baixar_pendentes_async(pendentes, anos_meses_registrados))
+        if meses_nao_salvos:
+            salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
+        # Chamar o converterCSV no mesmo processo (sem subir outro interpretador)
         try:
-            subprocess.run(['python', 'converterCSV.py'], check=True)
-            registrar_log("Script converterCSV.py executado com sucesso.")
-        except FileNotFoundError:
-            registrar_log("Erro: Script converterCSV.py não encontrado.")
-        except subprocess.CalledProcessError as e:
-            registrar_log(f"Erro ao executar o script converterCSV.py: {e}")
-        break
-
-    except ConnectionRefusedError as e:
-        registrar_log(f"Erro de conexão (10061): {e}. Tentando novamente em {retry_interval} segundos.")
-        time.sleep(retry_interval)
+            import converterCSV
+        except ImportError as e:
+            registrar_log(f"Erro: Script converterCSV.py não encontrado ou sem dependências: {e}")
+        else:
+            try:
+                converterCSV.main()
+                registrar_log("Script converterCSV.py executado com sucesso.")
+            except Exception as e:
+                registrar_log(f"Erro ao executar o script converterCSV.py: {e}")
     except Exception as e:
         registrar_log(f"Erro inesperado: {e}")
-        ftp.quit()
-        exit()
+        if meses_nao_salvos:
+            salvar_ano_mes_registrado(local_year_month_file, anos_meses_registrados)
+        encerrar_ftp(ftp)
+
+
+if __name__ == '__main__':
+    # Guard obrigatório: o converterCSV usa ProcessPoolExecutor, e os workers reimportam este módulo
+    main()
@@ -1,10 +1,15 @@
+import csv
 import os
 import re
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Optional, Tuple
 
 import pandas as pd
 import py7zr
+import pyarrow as pa
+from pyarrow import csv as pacsv
 
 BASE_DIR = Path(__file__).parent
 log_file = str(BASE_DIR / 'log_ConverterCSV.txt')
@@ -18,6 +23,11 @@ def registrar_log(mensagem: str) -> None:
 RAW_FOLDER = BASE_DIR / 'CAGEDMOV_downloads'
 OUTPUT_FOLDER = BASE_DIR / 'CAGED_limpos'
 
+# Extração (LZMA) é só CPU: um processo por núcleo.
+MAX_WORKERS_7Z = os.cpu_count() or 1
+# Cada TXT mensal ocupa alguns GB em memória ao ser lido; limita os processos simultâneos.
+MAX_WORKERS_TXT = max(1, min(4, os.cpu_count() or 1))
+
 REQUIRED_CANONICAL = [
     'competênciamov',
     'município',
@@ -83,37 +93,64 @@ RENAME_MAP = {
     'tipodedeficiência': 'tipodedeficiência',
 }
 
+# Colunas gravadas como category no Parquet de saída (nomes já renomeados)
+CATEGORICAS_SAIDA = [
+    'competencia_mov',
+    'municipio',
+    'cnae20subclasse',
+    'cbo2002ocupacao',
+    'grau_instrucao',
+    'raca_cor',
+    'genero',
+    'tipo_movimentacao',
+    'saldomovimentação',
+    'tipodedeficiência',
+]
+
+
+def _extract_one(arquivo: Path) -> Tuple[str, Optional[str]]:
+    try:
+        with py7zr.SevenZipFile(arquivo, mode='r') as z:
+            z.extractall(path=RAW_FOLDER)
+        arquivo.unlink()
+        return arquivo.name, None
+    except Exception as exc:  # noqa: BLE001
+        return arquivo.name, str(exc)
+
 
 def extrair_arquivos() -> None:
     if not RAW_FOLDER.exists():
         registrar_log('Não foi possivel encontrar a pasta CAGEDMOV_downloads')
         return
 
-    for arquivo in RAW_FOLDER.glob('*.7z'):
-        try:
-            with py7zr.SevenZipFile(arquivo, mode='r') as z:
-                z.extractall(path=RAW_FOLDER)
-            arquivo.unlink()
-            registrar_log(f'Arquivo {arquivo.name} extraído com sucesso')
-        except Exception as exc:  # noqa: BLE001
-            registrar_log(f'Erro ao extrair {arquivo.name}: {exc}')
+    arquivos = sorted(RAW_FOLDER.glob('*.7z'))
+    if not arquivos:
+        return
+    # Um arquivo por processo; o log é escrito aqui, depois que o pool termina
+    with ProcessPoolExecutor(max_workers=min(MAX_WORKERS_7Z, len(arquivos))) as ex:
+        resultados = list(ex.map(_extract_one, arquivos))
+    for nome, erro in resultados:
+        if erro is None:
+            registrar_log(f'Arquivo {nome} extraído com sucesso')
+        else:
+            registrar_log(f'Erro ao extrair {nome}: {erro}')
+
+
+# Remove o separador de milhar e troca a vírgula decimal por ponto numa única passada
+_SALARIO_TRANS = str.maketrans({'.': None, ',': '.'})
 
 
 def limpar_salario(coluna: pd.Series) -> pd.Series:
-    return (
-        coluna.astype(str)
-        .str.replace('.', '', regex=False)
-        .str.replace(',', '.', regex=False)
-        .str.strip()
-    )
+    return coluna.astype(str).str.translate(_SALARIO_TRANS).str.strip()
+
+
+_NAO_ALFANUM = re.compile(r'[^a-z0-9_]+')
 
 
 def normalizar_texto(s: str) -> str:
-    s = s.strip().lower()
-    s = unicodedata.normalize('NFKD', s)
-    s = ''.join(ch for ch in s if not unicodedata.combining(ch))
-    s = re.sub(r'[^a-z0-9_]+', '', s)
-    return s
+    # NFKD + encode ascii/ignore remove os acentos numa única chamada em C
+    s = unicodedata.normalize('NFKD', s.strip().lower()).encode('ascii', 'ignore').decode('ascii')
+    return _NAO_ALFANUM.sub('', s)
 
 
 def construir_mapa_colunas(colunas_originais) -> dict:
@@ -129,77 +166,79 @@ def construir_mapa_colunas(colunas_originais) -> dict:
     return mapa
 
 
+# Colunas de texto do Arrow viram StringDtype('pyarrow'): continuam em Arrow, com o accessor .str completo
+_ARROW_STRING = {pa.string(): pd.StringDtype('pyarrow')}
+
+
+def ler_cabecalho(txt_path: Path, enc: str) -> list:
+    # utf-8-sig descarta o BOM, senão o nome da primeira coluna não bate com o schema
+    with open(txt_path, 'r', encoding='utf-8-sig' if enc == 'utf-8' else enc, newline='') as f:
+        return next(csv.reader(f, delimiter=';'))
+
+
 def processar_txt(txt_path: Path) -> None:
-    def tentar_ler(enc: str):
-        return pd.read_csv(
+    def tentar_ler(enc: str, colunas: list):
+        # Parser C++ multithread do Arrow; só as colunas usadas, todas como texto (preserva zeros à esquerda)
+        tabela = pacsv.read_csv(
             txt_path,
-            sep=';',
-            dtype=str,
-            encoding=enc,
-            engine='python',
-            on_bad_lines='skip',
+            read_options=pacsv.ReadOptions(encoding=enc),
+            parse_options=pacsv.ParseOptions(delimiter=';', invalid_row_handler=lambda _row: 'skip'),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=colunas,
+                column_types={c: pa.string() for c in colunas},
+            ),
         )
+        return tabela.to_pandas(types_mapper=_ARROW_STRING.get)
 
+    requisitos = {'competenciamov', 'municipio', 'subclasse', 'cbo2002ocupacao', 'graudeinstrucao', 'racacor', 'tipomovimentacao'}
     df = None
     for enc in ('utf-8', 'cp1252', 'latin-1'):
         try:
-            tmp = tentar_ler(enc)
-            cols_norm = {normalizar_texto(c) for c in tmp.columns}
-            requisitos = {'competenciamov', 'municipio', 'subclasse', 'cbo2002ocupacao', 'graudeinstrucao', 'racacor', 'tipomovimentacao'}
-            if requisitos.issubset(cols_norm) or len(requisitos.intersection(cols_norm)) >= 5:
-                df = tmp
-                break
+            # Lê só o cabeçalho para resolver os aliases antes de parsear o arquivo inteiro
+            cabecalho = ler_cabecalho(txt_path, enc)
+            cols_norm = {normalizar_texto(c) for c in cabecalho}
+            if not (requisitos.issubset(cols_norm) or len(requisitos.intersection(cols_norm)) >= 5):
+                continue
+            mapa_colunas = construir_mapa_colunas(cabecalho)
+            faltantes = [c for c in REQUIRED_CANONICAL if c not in mapa_colunas]
+            if faltantes:
+                disponiveis_norm = ', '.join(sorted(c.strip() for c in cabecalho))
+                registrar_log(
+                    f'Colunas ausentes em {txt_path.name}: {", ".join(faltantes)}'
+                )
+                registrar_log(f'Colunas encontradas: {disponiveis_norm}')
+                return
+
+            select_cols_dst = REQUIRED_CANONICAL + [c for c in OPTIONAL_CANONICAL if c in mapa_colunas]
+            df = tentar_ler(enc, [mapa_colunas[c] for c in select_cols_dst])
+            df.columns = select_cols_dst
+            break
         except Exception:
             continue
     if df is None:
         registrar_log(f'Erro ao ler {txt_path.name}: falha em todas codificações (utf-8, cp1252, latin-1)')
         return
 
-    df.columns = [col.strip() for col in df.columns]
-    mapa_colunas = construir_mapa_colunas(list(df.columns))
-    faltantes = [c for c in REQUIRED_CANONICAL if c not in mapa_colunas]
-    if faltantes:
-        disponiveis_norm = ', '.join(sorted(df.columns))
-        registrar_log(
-            f'Colunas ausentes em {txt_path.name}: {", ".join(faltantes)}'
-        )
-        registrar_log(f'Colunas encontradas: {disponiveis_norm}')
-        return
-
-    select_cols_src = [mapa_colunas[c] for c in REQUIRED_CANONICAL]
-    select_cols_dst = REQUIRED_CANONICAL.copy()
-    for opt in OPTIONAL_CANONICAL:
-        if opt in mapa_colunas:
-            select_cols_src.append(mapa_colunas[opt])
-            select_cols_dst.append(opt)
-    df = df[select_cols_src].copy()
-    df.columns = select_cols_dst
-
-    required_now = ['competênciamov','município','cnae20subclasse','cbo2002ocupação','graudeinstrução','idade','raça/cor','sexo','salário','tipomovimentação']
+    # Linha final de totais: algum campo obrigatório vazio
     if not df.empty:
-        ultima = df.iloc[-1]
-        try:
-            if any(pd.isna(ultima[col]) or str(ultima[col]).strip()=='' for col in required_now):
-                df = df.iloc[:-1].copy()
-        except Exception:
-            pass
+        ultima = df[REQUIRED_CANONICAL].iloc[-1].fillna('').astype(str).str.strip()
+        if (ultima == '').any():
+            df = df.iloc[:-1].copy()
 
     col_tip = df['tipomovimentação'].astype(str).str.strip()
-    tipomov_num = pd.to_numeric(col_tip, errors='coerce')
-    mask_tip_num = tipomov_num.isin([10, 20, 25])
-
-    col_tip_txt = (
-        col_tip.str.lower()
-        .str.normalize('NFKD')
-        .str.encode('ascii', errors='ignore')
-        .str.decode('ascii')
-    )
-    mask_tip_txt = col_tip_txt.str.contains('admi')
+    # Comparação direta com os códigos em texto (hash em C), sem converter a coluna para float
+    mask_tip_num = col_tip.isin({'10', '20', '25'})
+
+    # tipomovimentação tem poucos valores distintos: normaliza cada um uma vez e propaga para as linhas
+    admissao_por_valor = {
+        v: 'admi' in unicodedata.normalize('NFKD', v.lower()).encode('ascii', 'ignore').decode('ascii')
+        for v in col_tip.unique()
+    }
+    mask_tip_txt = col_tip.map(admissao_por_valor).fillna(False).astype(bool)
 
     mask_saldo = pd.Series([False] * len(df))
     if 'saldomovimentação' in df.columns:
-        saldo_num = pd.to_numeric(df['saldomovimentação'].astype(str).str.strip(), errors='coerce')
-        mask_saldo = saldo_num == 1
+        mask_saldo = df['saldomovimentação'].astype(str).str.strip().eq('1')
 
     df = df[mask_tip_num | mask_tip_txt | mask_saldo]
 
@@ -230,12 +269,20 @@ def processar_txt(txt_path: Path) -> None:
     df['cnae20subclasse'] = df['cnae20subclasse'].str.strip()
     df['cbo2002ocupacao'] = df['cbo2002ocupacao'].str.strip()
 
+    # Códigos de baixa cardinalidade como category (dicionário no Parquet) e idade em 16 bits.
+    # Códigos ficam como texto para preservar zeros à esquerda (cnae, cbo, município).
+    # Idades fora de [0, 120] viram NA antes do downcast (Int16 faria 40000 -> -25536); a linha
+    # continua no arquivo para a contagem bruta e sai no filtro de idade da agregação.
+    df = df.astype({c: 'category' for c in CATEGORICAS_SAIDA if c in df.columns})
+    df['idade'] = df['idade'].where(df['idade'].between(0, 120)).astype('Int16')
+
     competencia = df['competencia_mov'].iloc[0] if not df.empty else txt_path.stem
     competencia = str(competencia).strip()
     OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
-    output_path = OUTPUT_FOLDER / f'CAGEDMOV_limpo_{competencia}.csv'
+    output_path = OUTPUT_FOLDER / f'CAGEDMOV_limpo_{competencia}.parquet'
 
-    df.to_csv(output_path, index=False)
+    # Parquet colunar (zstd + dicionário) no lugar do CSV: menor em disco e muito mais rápido de reler
+    df.to_parquet(output_path, engine='pyarrow', compression='zstd', index=False)
     registrar_log(f'Arquivo limpo gerado: {output_path.name}')
 
 
@@ -253,8 +300,11 @@ def main() -> None:
     if meses_filtro:
         arquivos = [p for p in arquivos if any(m in p.stem for m in meses_filtro)]
 
-    for txt_path in sorted(arquivos):
-        processar_txt(txt_path)
+    if not arquivos:
+        return
+    # Cada TXT é independente: processa em paralelo (cada worker grava seu próprio Parquet)
+    with ProcessPoolExecutor(max_workers=min(MAX_WORKERS_TXT, len(arquivos))) as ex:
+        list(ex.map(processar_txt, sorted(arquivos)))
 
 
 if __name__ == '__main__':
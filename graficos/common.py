@@ -1,16 +1,33 @@
 from __future__ import annotations
 
+import functools
+import hashlib
+from contextlib import contextmanager
 import json
 import math
+import os
 import sqlite3
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson  # type: ignore
+    HAS_ORJSON = True
+except Exception:
+    HAS_ORJSON = False
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DB_PATH = BASE_DIR / 'projeto_caged.db'
 VIZ_DIR = BASE_DIR / 'viz'
 DATA_DIR = VIZ_DIR / 'data'
+CACHE_DIR = BASE_DIR / '.cache'
+
+# Dimensões agregadas juntas na varredura única de dados_agregados
+DIMENSOES_MULTI = ['genero', 'raca_cor', 'grau_instrucao', 'tipodedeficiência']
 
 
 def ensure_dirs() -> None:
@@ -18,39 +35,128 @@ def ensure_dirs() -> None:
     DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 
+@functools.lru_cache(maxsize=1)
 def connect() -> sqlite3.Connection:
+    """Conexão única por processo, compartilhada por todos os módulos de gráficos (somente leitura)."""
     if not DB_PATH.exists():
         raise FileNotFoundError(f'Banco não encontrado: {DB_PATH}')
-    return sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(DB_PATH)
+    # Só PRAGMAs de leitura: WAL e índices vêm do storage.py (leitores não bloqueiam a escrita do pipeline)
+    conn.execute('PRAGMA query_only=ON;')
+    conn.execute('PRAGMA mmap_size=268435456;')  # 256MB
+    conn.execute('PRAGMA temp_store=MEMORY;')
+    conn.execute('PRAGMA cache_size=-200000;')  # ~200MB
+    return conn
+
+
+@contextmanager
+def conexao() -> Iterator[sqlite3.Connection]:
+    """Entrega a conexão compartilhada (cache de páginas quente); desfaz a transação em caso de erro, sem fechar."""
+    conn = connect()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def cached_read_sql(conn: sqlite3.Connection, sql: str, params: Optional[Any] = None) -> pd.DataFrame:
+    """pd.read_sql com cache em disco (.cache/<versão>_<hash>.parquet).
+
+    A versão junta mtime_ns e tamanho do banco e do seu -wal: em WAL uma escrita só chega ao arquivo
+    principal no checkpoint, então o mtime dele sozinho não basta. A chave é blake2b(sql, params);
+    entradas de outras versões são removidas na próxima gravação.
+    """
+    db_file = Path(conn.execute('PRAGMA database_list').fetchone()[2])
+    partes = []
+    for caminho in (db_file, db_file.with_name(db_file.name + '-wal')):
+        try:
+            info = caminho.stat()
+            partes.append(f'{info.st_mtime_ns}-{info.st_size}')
+        except FileNotFoundError:
+            partes.append('0-0')
+    versao = '-'.join(partes)
+    chave = hashlib.blake2b(repr((sql, tuple(params or ()))).encode('utf-8'), digest_size=16).hexdigest()
+    cache_path = CACHE_DIR / f'{versao}_{chave}.parquet'
+    if cache_path.exists():
+        return pd.read_parquet(cache_path)
+
+    df = pd.read_sql(sql, conn, params=params)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    for antigo in CACHE_DIR.glob('*.parquet'):
+        if not antigo.name.startswith(f'{versao}_'):
+            antigo.unlink(missing_ok=True)
+    tmp_path = cache_path.with_suffix('.tmp')
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, cache_path)
+    return df
+
+
+def load_agregado_multi(conn: Optional[sqlite3.Connection] = None) -> pd.DataFrame:
+    """Uma única varredura de dados_agregados por (data, gênero, raça, instrução, deficiência).
+
+    Retorna as colunas data, DIMENSOES_MULTI, s (soma de salários) e n (admissões); cada gráfico/modelo
+    deriva sua série somando as outras dimensões em memória. Passa por cached_read_sql.
+    """
+    conn = conn if conn is not None else connect()
+    cols = {r[1] for r in conn.execute("PRAGMA table_info('dados_agregados')")}
+    col_def = '"tipodedeficiência"' if 'tipodedeficiência' in cols else "'9'"
+    sql = f"""
+        SELECT data, genero, raca_cor, grau_instrucao, {col_def} AS "tipodedeficiência",
+               SUM(soma_salario) AS s, SUM(total_admissoes) AS n
+        FROM dados_agregados
+        WHERE total_admissoes > 0
+        GROUP BY data, genero, raca_cor, grau_instrucao, {col_def}
+    """
+    df = cached_read_sql(conn, sql)
+    for col in DIMENSOES_MULTI:
+        df[col] = df[col].astype(str)
+    return df
+
+
+def pivot_denso(df: pd.DataFrame, col: str, codigos: List[str], valor: str) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Pivot (data × código) por scatter numpy numa matriz pré-alocada.
+
+    Retorna as categorias 'YYYY-MM', a matriz (n_datas, len(codigos)) com NaN onde não há valor
+    e a máscara dos códigos presentes. Códigos fora de `codigos` são ignorados.
+    """
+    datas, data_idx = np.unique(df['data'].to_numpy(dtype=str), return_inverse=True)
+    cod_idx = pd.Index(codigos).get_indexer(df[col].astype(str))
+    ok = cod_idx >= 0
+    out = np.full((len(datas), len(codigos)), np.nan)
+    out[data_idx[ok], cod_idx[ok]] = df[valor].to_numpy(dtype=float)[ok]
+    presentes = np.zeros(len(codigos), dtype=bool)
+    presentes[cod_idx[ok]] = True
+    # np.unique já ordena as datas ISO lexicograficamente; só fatia 'YYYY-MM'
+    categorias = [d[:7] for d in datas.tolist()]
+    return categorias, out, presentes
+
+
+def _sanitize(obj: Any) -> Any:
+    # Sanitize NaN/Inf recursively to emit valid JSON (use null instead)
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return {k: _sanitize(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_sanitize(v) for v in obj]
+    # Normalize numpy scalars to native Python
+    if isinstance(obj, (np.floating, np.integer)):
+        obj = obj.item()
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    return obj
 
 
 def save_json(name: str, payload: Dict[str, Any]) -> Path:
     ensure_dirs()
     out_path = DATA_DIR / f'{name}.json'
-    # Sanitize NaN/Inf recursively to emit valid JSON (use null instead)
-    def _sanitize(obj: Any) -> Any:
-        try:
-            import numpy as _np  # type: ignore
-        except Exception:  # pragma: no cover - numpy should exist via pandas, but be defensive
-            _np = None  # type: ignore
-
-        if obj is None:
-            return None
-        if isinstance(obj, dict):
-            return {k: _sanitize(v) for k, v in obj.items()}
-        if isinstance(obj, (list, tuple)):
-            return [_sanitize(v) for v in obj]
-        # Normalize numpy scalars
-        if 'numpy' in str(type(obj)):
-            try:
-                # Convert numpy numeric types to native Python
-                if _np is not None and isinstance(obj, (_np.floating, _np.integer)):
-                    obj = obj.item()
-            except Exception:
-                pass
-        if isinstance(obj, float):
-            return obj if math.isfinite(obj) else None
-        return obj
+    if HAS_ORJSON:
+        # Uma única passada em C: NaN/Inf viram null e escalares/arrays numpy são serializados direto
+        out_path.write_bytes(
+            orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        )
+        return out_path
 
     cleaned = _sanitize(payload)
     with out_path.open('w', encoding='utf-8') as f:
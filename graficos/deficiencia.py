@@ -5,7 +5,7 @@ from typing import Dict, List
 
 import pandas as pd
 
-from .common import connect, save_json
+from .common import conexao, connect, save_json
 
 COL_DEF = 'tipodedeficiência'
 
@@ -24,8 +24,8 @@ DEF_ORDEM = list(DEF_MAP.keys())
 
 
 def gerar_json() -> Path:
-    with connect() as _conn:
-        cols = [r[1] for r in _conn.execute("PRAGMA table_info('dados_agregados')").fetchall()]
+    conn = connect()
+    cols = [r[1] for r in conn.execute("PRAGMA table_info('dados_agregados')").fetchall()]
     if COL_DEF not in cols:
         payload = {
             'title': 'Salário Médio de Admissão por Tipo de Deficiência',
@@ -47,8 +47,7 @@ def gerar_json() -> Path:
         ORDER BY data
     """
 
-    with connect() as conn:
-        df = pd.read_sql(sql, conn)
+    df = pd.read_sql(sql, conn)
 
     if df.empty:
         payload = {
@@ -61,12 +60,13 @@ def gerar_json() -> Path:
         }
         return save_json('deficiencia', payload)
 
-    df['data'] = pd.to_datetime(df['data'])
+    # 'data' já é ISO ('YYYY-MM'): ordena como string e fatia, sem parse para Timestamp
+    df['data'] = df['data'].astype(str).str.slice(0, 7)
     df['deficiencia'] = df['deficiencia'].astype(str)
     df = df.sort_values(['data', 'deficiencia'])
 
     pivot = df.pivot(index='data', columns='deficiencia', values='salario_medio')
-    categorias = [d.strftime('%Y-%m') for d in pivot.index]
+    categorias = pivot.index.tolist()
 
     palette = ['#4e79a7','#f28e2b','#e15759','#76b7b2','#59a14f','#edc948','#b07aa1','#9c755f']
 
@@ -97,7 +97,7 @@ def gerar_json() -> Path:
 
 
 def imprimir_resumo(ano: str = '2025') -> None:
-    with connect() as conn:
+    with conexao() as conn:
         df = pd.read_sql(
             f"""
             SELECT "{COL_DEF}" AS deficiencia,
@@ -112,14 +112,12 @@ def imprimir_resumo(ano: str = '2025') -> None:
         )
 
     print(f'=== Salário Médio por Tipo de Deficiência — {ano} ===')
-    for _, row in df.iterrows():
-        cod = str(row['deficiencia'])
-        nome = DEF_MAP.get(cod, f'Código {cod}')
-        try:
-            val = float(row['media'])
-            print(f"  {nome:<22} | R$ {val:,.2f}")
-        except Exception:
-            print(f"  {nome:<22} | (sem dados)")
+    if df.empty:
+        return
+    nomes = df['deficiencia'].astype(str).map(lambda cod: DEF_MAP.get(cod, f'Código {cod}'))
+    medias = pd.to_numeric(df['media'], errors='coerce')
+    valores = medias.map('R$ {:,.2f}'.format, na_action='ignore').fillna('(sem dados)')
+    print('\n'.join('  ' + nomes.str.ljust(22) + ' | ' + valores))
 
 
 if __name__ == '__main__':
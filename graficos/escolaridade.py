@@ -5,7 +5,7 @@ from typing import Dict, List, Tuple
 
 import pandas as pd
 
-from .common import connect, save_json
+from .common import conexao, save_json
 
 
 # Mapeamento básico (padrão CAGED/eSocial). Caso algum código não exista aqui, cai no rótulo "Código X".
@@ -41,7 +41,7 @@ def gerar_json() -> Path:
         GROUP BY data, grau_instrucao
         ORDER BY data
     """
-    with connect() as conn:
+    with conexao() as conn:
         df = pd.read_sql(sql, conn)
 
     if df.empty:
@@ -55,21 +55,20 @@ def gerar_json() -> Path:
         }
         return save_json('escolaridade', payload)
 
-    df['data'] = pd.to_datetime(df['data'])
+    # 'data' já é ISO ('YYYY-MM'): basta fatiar a string, sem parse para Timestamp
+    df['data_str'] = df['data'].astype(str).str.slice(0, 7)
     df['grau_instrucao'] = df['grau_instrucao'].astype(str)
-    df = df.sort_values(['data', 'grau_instrucao'])
+
+    # Matriz mês × escolaridade num único pivot (0 para ausência)
+    pivot = df.pivot_table(
+        index='data_str', columns='grau_instrucao', values='total', aggfunc='sum', fill_value=0
+    ).sort_index()
 
     # Categorias do eixo X
-    categorias = sorted(df['data'].dt.strftime('%Y-%m').unique().tolist())
+    categorias = pivot.index.tolist()
 
     # Ordem estável de escolaridade e gênero
-    esc_ordem = sorted([c for c in df['grau_instrucao'].unique().tolist() if c not in IGNORAR_ESC], key=lambda x: (len(x), x))
-
-    # Tabela para buscar valores rapidamente
-    # index: (data_str, esc) -> total
-    df['data_str'] = df['data'].dt.strftime('%Y-%m')
-    key_cols = ['data_str', 'grau_instrucao']
-    lookup = df.set_index(key_cols)['total'].to_dict()
+    esc_ordem = sorted([c for c in pivot.columns.tolist() if c not in IGNORAR_ESC], key=lambda x: (len(x), x))
 
     # Monta séries no formato Highcharts: uma coluna empilhada por mês (sem separar por sexo).
     series: List[Dict] = []
@@ -78,17 +77,11 @@ def gerar_json() -> Path:
     palette = ['#4e79a7','#f28e2b','#e15759','#76b7b2','#59a14f','#edc948','#b07aa1','#ff9da7','#9c755f','#bab0ac']
 
     for esc_idx, esc in enumerate(esc_ordem):
-        name = _rotulo_escolaridade(esc)
-        color = palette[esc_idx % len(palette)]
-        data_vals = []
-        for cat in categorias:
-            v = lookup.get((cat, esc), 0)
-            data_vals.append(int(v))  # 0 para ausência
         series.append({
             'type': 'column',
-            'name': name,
-            'data': data_vals,
-            'color': color,
+            'name': _rotulo_escolaridade(esc),
+            'data': pivot[esc].astype(int).tolist(),
+            'color': palette[esc_idx % len(palette)],
         })
 
     payload = {
@@ -109,7 +102,7 @@ def gerar_json() -> Path:
 
 def imprimir_resumo() -> None:
     # Mostra composição média de 2025 por escolaridade (somando ambos os sexos)
-    with connect() as conn:
+    with conexao() as conn:
         df = pd.read_sql(
             f"""
             SELECT grau_instrucao, SUM(total_admissoes) AS total
@@ -122,10 +115,12 @@ def imprimir_resumo() -> None:
         )
     total = df['total'].sum() if not df.empty else 0
     print('=== Composição 2025 por Escolaridade (ambos os sexos) ===')
-    for _, row in df.sort_values('total', ascending=False).iterrows():
-        nome = _rotulo_escolaridade(str(row['grau_instrucao']))
-        pct = (row['total'] / total * 100) if total else 0
-        print(f"  {nome:<24} | {row['total']:>10,} | {pct:5.2f}%")
+    if df.empty:
+        return
+    df = df.sort_values('total', ascending=False)
+    nomes = df['grau_instrucao'].astype(str).map(_rotulo_escolaridade)
+    pct = (df['total'] / total * 100) if total else pd.Series(0.0, index=df.index)
+    print('\n'.join('  ' + nomes.str.ljust(24) + ' | ' + df['total'].map('{:>10,}'.format) + ' | ' + pct.map('{:5.2f}%'.format)))
 
 
 if __name__ == '__main__':
@@ -1,42 +1,28 @@
 from __future__ import annotations
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from typing import Dict
 
-from .common import connect, save_json
+from .common import conexao, load_agregado_multi, pivot_denso, save_json
 
 
 GENERO_MAP = {'1': 'Homens', '3': 'Mulheres'}
 
 
 def gerar_json() -> Path:
-    sql = """
-        SELECT data, genero,
-               SUM(soma_salario)*1.0/SUM(total_admissoes) AS salario_medio
-        FROM dados_agregados
-        WHERE total_admissoes > 0
-        GROUP BY data, genero
-        ORDER BY data
-    """
-    with connect() as conn:
-        df = pd.read_sql(sql, conn)
-
-    # Garantias de tipo/ordem
-    df['data'] = pd.to_datetime(df['data'])
-    df['genero'] = df['genero'].astype(str)
-    df = df.sort_values(['data', 'genero'])
-
-    # Pivota para Highcharts: uma série por gênero
-    pivot = df.pivot(index='data', columns='genero', values='salario_medio')
-    categorias = [d.strftime('%Y-%m') for d in pivot.index]
+    # Deriva da varredura compartilhada (data × dimensões) em vez de um GROUP BY próprio
+    df = load_agregado_multi().groupby(['data', 'genero'], as_index=False)[['s', 'n']].sum()
+    df['salario_medio'] = df['s'] / df['n']
+
+    # Pivota para Highcharts: uma série por gênero (NaN vira null no save_json)
+    categorias, matriz, presentes = pivot_denso(df, 'genero', list(GENERO_MAP), 'salario_medio')
 
     series = []
-    for cod, nome in GENERO_MAP.items():
-        if cod in pivot.columns:
-            col = pivot[cod].round(2)
-            vals = col.where(col.notna(), None).tolist()
-            series.append({'name': nome, 'data': vals})
+    for j, (cod, nome) in enumerate(GENERO_MAP.items()):
+        if presentes[j]:
+            series.append({'name': nome, 'data': np.round(matriz[:, j], 2).tolist()})
 
     payload = {
         'title': 'Salário Médio de Admissão por Gênero',
@@ -49,7 +35,7 @@ def gerar_json() -> Path:
 
 
 def imprimir_disparidades() -> None:
-    with connect() as conn:
+    with conexao() as conn:
         # 2025
         df_2025 = pd.read_sql(
             """
@@ -71,8 +57,10 @@ def imprimir_disparidades() -> None:
         )
 
     def gap(df: pd.DataFrame) -> Dict[str, float]:
-        m = float(df.loc[df['genero'].astype(str) == '1', 'media'].values[0]) if '1' in df['genero'].astype(str).values else float('nan')
-        f = float(df.loc[df['genero'].astype(str) == '3', 'media'].values[0]) if '3' in df['genero'].astype(str).values else float('nan')
+        # Converte uma única vez em dict código -> média
+        medias = dict(zip(df['genero'].astype(str), df['media'].astype(float)))
+        m = medias.get('1', float('nan'))
+        f = medias.get('3', float('nan'))
         hiato = (f / m) * 100 if m and m == m and f == f else float('nan')
         diferenca = (1 - f / m) * 100 if m and m == m and f == f else float('nan')
         return {'masc': m, 'fem': f, 'hiato_pct': hiato, 'gap_pct': diferenca}
@@ -1,10 +1,11 @@
 from __future__ import annotations
 
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from typing import Dict, List
 
-from .common import connect, save_json
+from .common import conexao, load_agregado_multi, pivot_denso, save_json
 
 
 RACA_MAP = {
@@ -26,30 +27,19 @@ RACA_COLORS = {
 
 
 def gerar_json() -> Path:
-    sql = """
-        SELECT data, raca_cor,
-               SUM(soma_salario)*1.0/SUM(total_admissoes) AS salario_medio
-        FROM dados_agregados
-        WHERE total_admissoes > 0
-        GROUP BY data, raca_cor
-        ORDER BY data
-    """
-    with connect() as conn:
-        df = pd.read_sql(sql, conn)
-
-    df['data'] = pd.to_datetime(df['data'])
-    df['raca_cor'] = df['raca_cor'].astype(str)
-    df = df.sort_values(['data', 'raca_cor'])
-
-    pivot = df.pivot(index='data', columns='raca_cor', values='salario_medio')
-    categorias = [d.strftime('%Y-%m') for d in pivot.index]
-
-    series = []
-    for cod, nome in RACA_MAP.items():
-        if cod in pivot.columns:
-            col = pivot[cod].round(2)
-            vals = col.where(col.notna(), None).tolist()
-            series.append({'name': nome, 'data': vals, 'color': RACA_COLORS.get(nome)})
+    # Deriva da varredura compartilhada (data × dimensões) em vez de um GROUP BY próprio
+    df = load_agregado_multi().groupby(['data', 'raca_cor'], as_index=False)[['s', 'n']].sum()
+    df['salario_medio'] = df['s'] / df['n']
+
+    categorias, matriz, presentes = pivot_denso(df, 'raca_cor', list(RACA_MAP), 'salario_medio')
+
+    # Uma máscara NaN, um arredondamento e um cast para a matriz inteira (NaN -> None = null no JSON)
+    valores = np.where(np.isnan(matriz), None, np.round(matriz, 2))
+    series = [
+        {'name': RACA_MAP[cod], 'data': valores[:, j].tolist(), 'color': RACA_COLORS.get(RACA_MAP[cod])}
+        for j, cod in enumerate(RACA_MAP)
+        if presentes[j]
+    ]
 
     payload = {
         'title': 'Salário Médio de Admissão por Raça/Cor',
@@ -63,7 +53,7 @@ def gerar_json() -> Path:
 
 def imprimir_disparidades() -> None:
     # Razão vs Branca (1) por período e geral
-    with connect() as conn:
+    with conexao() as conn:
         df_2025 = pd.read_sql(
             """
             SELECT raca_cor, SUM(soma_salario)*1.0/SUM(total_admissoes) AS media
@@ -84,18 +74,16 @@ def imprimir_disparidades() -> None:
         )
 
     def ratios(df: pd.DataFrame) -> List[str]:
-        df = df.copy()
-        df['raca_cor'] = df['raca_cor'].astype(str)
-        base = df.loc[df['raca_cor'] == '1', 'media']
-        if base.empty or pd.isna(base.values[0]):
+        # Converte uma única vez em dict código -> média
+        medias = dict(zip(df['raca_cor'].astype(str), df['media'].astype(float)))
+        b = medias.get('1')
+        if b is None or pd.isna(b):
             return ["Base 'Branca' indisponível"]
-        b = float(base.values[0])
         lines = []
         for cod, nome in RACA_MAP.items():
-            mrow = df.loc[df['raca_cor'] == cod, 'media']
-            if mrow.empty:
+            v = medias.get(cod)
+            if v is None:
                 continue
-            v = float(mrow.values[0])
             r = v / b if b else float('nan')
             lines.append(f"  {nome:<16} | média R$ {v:,.2f} | vs Branca: {r*100:,.2f}% | gap: {(1-r)*100:,.2f}%")
         return lines
@@ -1,11 +1,15 @@
 import logging
+import os
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, Optional, Tuple, List
 
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
+from scipy import sparse, stats
+
+from graficos.common import cached_read_sql, load_agregado_multi
 
 try:
     from pmdarima import auto_arima as _auto_arima
@@ -14,10 +18,27 @@ except Exception as _e:
     logging.warning('pmdarima indisponível (%s). Usando fallback com statsmodels.', _e)
     HAS_PMDARIMA = False
 
+try:
+    from joblib import Parallel, delayed
+    HAS_JOBLIB = True
+except Exception:
+    HAS_JOBLIB = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except Exception:
+    HAS_NUMBA = False
+
 
 DB_PATH = Path('projeto_caged.db')
 LOG_FILE_PATH = Path('modelagem_log.txt') 
 QUALIDADE_CSV = Path('output_final') / 'qualidade_mensal.csv'
+LIMIAR_QUALIDADE = 0.6  # Meses com peso_qualidade abaixo disso ficam fora das séries SARIMA
+MAX_WORKERS_SARIMA = os.cpu_count() or 1  # Processos para os ajustes SARIMA; 1 = execução serial
+REGRESSAO_CHUNK = 50_000  # Linhas por bloco na acumulação de X'X da regressão
+REGRESSAO_CATEGORIAS = ['genero_nome', 'raca_cor', 'cnae_divisao', 'grau_instrucao', 'tipo_def', 'regiao']
+VALID_RACA = {'1', '2', '3', '4', '5', '6', '9'}
 
 GENERO_MAP_SQL = {'1': 'MASC', '3': 'FEM'} 
 CENARIOS_ARIMA: List[Tuple[str, str]] = [('geral', 'brasil')]
@@ -51,29 +72,49 @@ GRUPOS_MAP = {
     }
 }
 
-# Configuração de Logging
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s | %(levelname)s | modelagem.py] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    handlers=[
-        logging.FileHandler(LOG_FILE_PATH, mode='w'),
-        logging.StreamHandler()
-    ]
-)
+
+def configurar_logging() -> None:
+    """Configuração de Logging (chamada em main: os workers do pool não truncam o log ao importar o módulo)."""
+    for handler in logging.root.handlers[:]:
+        logging.root.removeHandler(handler)
+    logging.basicConfig(
+        level=logging.INFO,
+        format='[%(asctime)s | %(levelname)s | modelagem.py] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        handlers=[
+            logging.FileHandler(LOG_FILE_PATH, mode='w'),
+            logging.StreamHandler()
+        ]
+    )
+
+
+def garantir_uf_regiao(conn: sqlite3.Connection) -> None:
+    """Tabela TEMP uf_regiao (código UF -> região) a partir do UF_MAP; idempotente.
+
+    Substitui o CASE de 27 ramos avaliado por linha por um único lookup na chave primária.
+    """
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS uf_regiao (uf TEXT PRIMARY KEY, regiao TEXT NOT NULL)')
+    conn.executemany(
+        'INSERT OR REPLACE INTO temp.uf_regiao (uf, regiao) VALUES (?, ?)',
+        [(code, regiao) for code, (_uf, regiao) in UF_MAP.items()],
+    )
+
+
+def _colunas_derivadas_sql(conn: sqlite3.Connection) -> Tuple[str, str]:
+    """Expressões de divisão CNAE e UF: colunas geradas (storage.criar_colunas_derivadas) ou SUBSTR em bancos antigos."""
+    colunas = {r[1] for r in conn.execute('PRAGMA table_xinfo(dados_agregados)')}
+    cnae_divisao_sql = 'cnae_divisao' if 'cnae_divisao' in colunas else 'SUBSTR(cnae20subclasse, 1, 2)'
+    uf_sql = 'uf_code' if 'uf_code' in colunas else 'SUBSTR(municipio, 1, 2)'
+    return cnae_divisao_sql, uf_sql
 
 
-def carregar_dados_para_regressao(conn: sqlite3.Connection) -> pd.DataFrame:
-    """Agrega dados no SQLite para regressão."""
+def carregar_dados_para_regressao(conn: sqlite3.Connection) -> int:
+    """Agrega dados no SQLite para regressão em temp.regressao_grupos; retorna o nº de grupos."""
     logging.info('Iniciando query de agregação (server-side) para Regressão...')
+    garantir_uf_regiao(conn)
     genero_sql = "CASE WHEN genero = '1' THEN 'MASC' WHEN genero = '3' THEN 'FEM' ELSE 'NA' END"
-    regiao_sql = "CASE "
-    for code, (uf, regiao) in UF_MAP.items():
-        regiao_sql += f"WHEN SUBSTR(municipio, 1, 2) = '{code}' THEN '{regiao}' "
-    regiao_sql += "ELSE 'NA' END"
-    cnae_divisao_sql = "SUBSTR(cnae20subclasse, 1, 2)"
+    regiao_sql = "COALESCE(ur.regiao, 'NA')"
+    cnae_divisao_sql, uf_sql = _colunas_derivadas_sql(conn)
 
     query = f"""
         SELECT
@@ -86,42 +127,102 @@ def carregar_dados_para_regressao(conn: sqlite3.Connection) -> pd.DataFrame:
             SUM(soma_salario) / SUM(total_admissoes) as salario_medio,
             SUM(soma_idade) / SUM(total_admissoes) as idade_media
         FROM dados_agregados
+        LEFT JOIN temp.uf_regiao AS ur ON ur.uf = {uf_sql}
         WHERE total_admissoes > 0 AND soma_salario > 0
-        GROUP BY genero_nome, raca_cor, cnae_divisao, grau_instrucao, tipo_def, regiao
+        GROUP BY genero_nome, raca_cor, cnae_divisao, grau_instrucao, tipo_def, {regiao_sql}
     """
-    df_reg = pd.read_sql(query, conn)
-    valid_raca = {'1','2','3','4','5','6','9'}
-    df_reg['raca_cor'] = df_reg['raca_cor'].astype(str)
-    df_reg.loc[~df_reg['raca_cor'].isin(valid_raca), 'raca_cor'] = '9'  # 'Não Identificado'
-    logging.info(f'Agregação da Regressão concluída. {len(df_reg)} grupos carregados.')
-    return df_reg
-
-
-def rodar_regressao(df_reg: pd.DataFrame, conn: sqlite3.Connection) -> None:
+    # Resultado fica no SQLite (TEMP); rodar_regressao o lê em blocos sem materializar tudo no pandas
+    conn.execute('DROP TABLE IF EXISTS temp.regressao_grupos')
+    conn.execute(f'CREATE TEMP TABLE regressao_grupos AS {query}')
+    total = conn.execute('SELECT COUNT(*) FROM temp.regressao_grupos').fetchone()[0]
+    logging.info(f'Agregação da Regressão concluída. {total} grupos carregados.')
+    return total
+
+
+def _normalizar_categoria(valores: pd.Series, coluna: str) -> pd.Series:
+    """Mesma limpeza para os valores distintos (ajuste das categorias) e para cada bloco de linhas."""
+    valores = valores.astype(str)
+    if coluna == 'raca_cor':
+        valores = valores.where(valores.isin(VALID_RACA), '9')  # 'Não Identificado'
+    return valores.str.upper().fillna('NA')
+
+
+def _ajustar_categorias(conn: sqlite3.Connection, colunas: List[str]) -> Dict[str, List[str]]:
+    """Primeira passada: categorias ordenadas de cada coluna (equivale ao fit de um OneHotEncoder)."""
+    categorias = {}
+    for coluna in colunas:
+        distintos = pd.read_sql(f'SELECT DISTINCT {coluna} FROM temp.regressao_grupos', conn)[coluna]
+        categorias[coluna] = sorted(_normalizar_categoria(distintos, coluna).unique())
+    return categorias
+
+
+def _dummies_esparsas(df: pd.DataFrame, categorias: Dict[str, List[str]]) -> sparse.csr_matrix:
+    """One-hot esparso equivalente a pd.get_dummies(prefix=coluna, drop_first=True) com categorias pré-ajustadas."""
+    n = len(df)
+    linhas = np.arange(n)
+    blocos = []
+    for coluna, cats in categorias.items():
+        codes = pd.Categorical(df[coluna], categories=cats).codes
+        manter = codes > 0
+        blocos.append(sparse.csr_matrix(
+            (np.ones(int(manter.sum()), dtype=np.float64), (linhas[manter], codes[manter] - 1)),
+            shape=(n, len(cats) - 1),
+        ))
+    return sparse.hstack(blocos, format='csr')
+
+
+def _ols_normal(XtX: np.ndarray, Xty: np.ndarray, yty: float, n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """OLS a partir das equações normais acumuladas; mesmos coeficientes e p-valores (t) do sm.OLS.
+
+    Blocos e acumuladores são float64 (em float32 coeficientes e p-valores se afastam do sm.OLS);
+    o sistema k×k é resolvido por pinv e a soma dos resíduos sai de y'y - 2β'X'y + β'X'Xβ.
+    """
+    XtX_inv = np.linalg.pinv(XtX)
+    beta = XtX_inv @ Xty
+    rss = max(yty - 2 * beta @ Xty + beta @ XtX @ beta, 0.0)
+    gl = n - np.linalg.matrix_rank(XtX)
+    sigma2 = rss / gl
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = beta / np.sqrt(np.diag(XtX_inv) * sigma2)
+    pvalues = 2 * stats.t.sf(np.abs(t), gl)
+    return beta, pvalues
+
+
+def rodar_regressao(total_grupos: int, conn: sqlite3.Connection) -> None:
     """Ajusta OLS log-linear e grava coeficientes."""
     logging.info('Iniciando modelo de Regressão...')
-    if df_reg.empty:
-        raise ValueError('DataFrame de regressão está vazio.')
-
-    df_reg['log_salario_medio'] = np.log(df_reg['salario_medio'])
-    categorias = ['genero_nome', 'raca_cor', 'cnae_divisao', 'grau_instrucao', 'tipo_def', 'regiao']
-    dummies_list = []
-    for coluna in categorias:
-        df_reg[coluna] = df_reg[coluna].astype(str).str.upper().fillna('NA')
-        dummies_list.append(coluna)
-
-    dummies = pd.get_dummies(df_reg[dummies_list], prefix=dummies_list, drop_first=True, dtype=np.int8)
-    X_parts = [dummies, df_reg['idade_media'].fillna(0)]
-    X = pd.concat(X_parts, axis=1)
-    X = sm.add_constant(X, has_constant='add')
-    Y = df_reg['log_salario_medio']
-
-    logging.info(f'Treinando modelo OLS com {len(X.columns)} variáveis...')
-    modelo = sm.OLS(Y, X).fit()
+    if not total_grupos:
+        raise ValueError('Base de regressão está vazia.')
+
+    categorias = _ajustar_categorias(conn, REGRESSAO_CATEGORIAS)
+    nomes = ['const'] + [f'{c}_{v}' for c, cats in categorias.items() for v in cats[1:]] + ['idade_media']
+    k = len(nomes)
+    XtX = np.zeros((k, k))
+    Xty = np.zeros(k)
+    yty = 0.0
+
+    # Matriz de projeto esparsa (CSR) por bloco: const + dummies (drop_first) + idade_media.
+    # Blocos em float64 como os acumuladores k×k: float32 desvia coeficientes e p-valores do sm.OLS.
+    logging.info(f'Treinando modelo OLS com {k} variáveis...')
+    for bloco in pd.read_sql('SELECT * FROM temp.regressao_grupos', conn, chunksize=REGRESSAO_CHUNK):
+        for coluna in REGRESSAO_CATEGORIAS:
+            bloco[coluna] = _normalizar_categoria(bloco[coluna], coluna)
+        n = len(bloco)
+        Xc = sparse.hstack([
+            sparse.csr_matrix(np.ones((n, 1), dtype=np.float64)),
+            _dummies_esparsas(bloco, categorias),
+            sparse.csr_matrix(bloco['idade_media'].fillna(0).to_numpy(dtype=np.float64).reshape(-1, 1)),
+        ], format='csr', dtype=np.float64)
+        yc = np.log(bloco['salario_medio'].to_numpy(dtype=np.float64))
+        XtX += (Xc.T @ Xc).toarray()
+        Xty += Xc.T @ yc
+        yty += float(yc @ yc)
+
+    params, pvalues = _ols_normal(XtX, Xty, yty, total_grupos)
     resultados = pd.DataFrame({
-        'variavel': modelo.params.index,
-        'coeficiente': modelo.params.values,
-        'p_valor': modelo.pvalues.values,
+        'variavel': nomes,
+        'coeficiente': params,
+        'p_valor': pvalues,
     })
     resultados.to_sql('coeficientes_regressao', conn, if_exists='replace', index=False)
     logging.info('Tabela coeficientes_regressao (Diagnóstico) atualizada.')
@@ -134,18 +235,19 @@ def carregar_dados_para_arima(conn: sqlite3.Connection, filtro_tipo: str, filtro
 
     quoted_group = f'"{grupo_coluna_sql}"' if any(ch in grupo_coluna_sql for ch in ' áàãâéêíóôõúçÁÀÃÂÉÊÍÓÔÕÚÇ') else grupo_coluna_sql
     where_clauses = [f"{quoted_group} IN ({','.join(['?'] * len(grupos_sql))})", "total_admissoes > 0", "soma_salario > 0"]
-    params = grupos_sql # Começa com os parâmetros do GRUPO
+    params = list(grupos_sql) # Começa com os parâmetros do GRUPO (cópia: não altera GRUPOS_DE_PROJECAO)
 
     if filtro_tipo == 'municipio':
         where_clauses.append("municipio = ?")
         params.append(filtro_valor)
     elif filtro_tipo == 'regiao':
-        regiao_sql = "CASE "
-        for code, (uf, regiao) in UF_MAP.items():
-            regiao_sql += f"WHEN SUBSTR(municipio, 1, 2) = '{code}' THEN '{regiao}' "
-        regiao_sql += "ELSE 'NA' END"
-        where_clauses.append(f"({regiao_sql}) = ?")
-        params.append(filtro_valor)
+        garantir_uf_regiao(conn)
+        _cnae_divisao_sql, uf_sql = _colunas_derivadas_sql(conn)
+        if filtro_valor == 'NA':
+            where_clauses.append(f"{uf_sql} NOT IN (SELECT uf FROM temp.uf_regiao)")
+        else:
+            where_clauses.append(f"{uf_sql} IN (SELECT uf FROM temp.uf_regiao WHERE regiao = ?)")
+            params.append(filtro_valor)
     elif filtro_tipo == 'cnae':
         where_clauses.append("cnae20subclasse LIKE ?")
         params.append(f"{filtro_valor}%")
@@ -166,80 +268,146 @@ def carregar_dados_para_arima(conn: sqlite3.Connection, filtro_tipo: str, filtro
             data
     """
     
-    df_agg = pd.read_sql(query, conn, params=params)
+    df_agg = cached_read_sql(conn, query, params)
     return df_agg
 
 
-def calcular_serie_salarial(df_agg_grupo: pd.DataFrame) -> pd.Series:
-    """Calcula a série temporal de salário para um grupo."""
-    if df_agg_grupo.empty:
-        return pd.Series(dtype=float)
+def agregar_arima_de_multi(df_multi: pd.DataFrame, grupo_coluna_sql: str, grupos_sql: List[str]) -> pd.DataFrame:
+    """Cenário 'geral': deriva o agregado do SARIMA da varredura única (load_agregado_multi), sem nova query."""
+    df = df_multi[df_multi[grupo_coluna_sql].isin(grupos_sql) & (df_multi['s'] > 0)]
+    df_agg = (
+        df.groupby(['data', grupo_coluna_sql], as_index=False)[['s', 'n']].sum()
+        .rename(columns={grupo_coluna_sql: 'grupo_valor', 's': 'soma_salario_total', 'n': 'total_admissoes_total'})
+        .sort_values('data', kind='stable')
+        .reset_index(drop=True)
+    )
+    return df_agg
 
-    # Dados já estão agregados, só precisamos calcular a média
-    df_agg_grupo = df_agg_grupo[df_agg_grupo['total_admissoes_total'] > 0].copy()
-    if df_agg_grupo.empty:
-        return pd.Series(dtype=float)
 
-    df_agg_grupo['media_salario'] = (
-        df_agg_grupo['soma_salario_total'] / df_agg_grupo['total_admissoes_total']
-    )
+def carregar_pesos_qualidade() -> Dict[str, float]:
+    """Lê qualidade_mensal.csv uma vez como dict mês -> peso_qualidade ({} se ausente)."""
     try:
         if QUALIDADE_CSV.exists():
             q = pd.read_csv(QUALIDADE_CSV, sep=';')
-            q['data'] = q['mes']
-            df_agg_grupo = df_agg_grupo.merge(q[['data','peso_qualidade']], on='data', how='left')
-            df_agg_grupo = df_agg_grupo[(df_agg_grupo['peso_qualidade'].fillna(1.0) >= 0.6)]
+            return dict(zip(q['mes'], q['peso_qualidade']))
     except Exception as _e:
-        logging.warning('Falha ao aplicar pesos de qualidade: %s', _e)
-    
-    # Define o 'data' como índice para a série temporal
-    serie = df_agg_grupo.set_index('data')['media_salario']
-    serie.index = pd.PeriodIndex(serie.index, freq='M')
-    return serie
+        logging.warning('Falha ao carregar pesos de qualidade: %s', _e)
+    return {}
+
+
+def _serie_np(soma, n, peso, limiar):
+    sel = (n > 0) & (peso >= limiar)
+    return np.flatnonzero(sel), soma[sel] / n[sel]
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _serie_kernel(soma, n, peso, limiar):
+        # Uma passada: filtra (admissões > 0 e peso de qualidade) e divide, sem cópias intermediárias
+        idx = np.empty(n.size, np.int64)
+        out = np.empty(n.size, np.float64)
+        k = 0
+        for i in range(n.size):
+            if n[i] > 0 and peso[i] >= limiar:
+                idx[k] = i
+                out[k] = soma[i] / n[i]
+                k += 1
+        return idx[:k], out[:k]
+else:
+    _serie_kernel = _serie_np
+
+
+def calcular_serie_salarial(df_agg_grupo: pd.DataFrame, pesos_qualidade: Optional[Dict[str, float]] = None) -> pd.Series:
+    """Calcula a série temporal de salário para um grupo.
+
+    `pesos_qualidade` (de carregar_pesos_qualidade) evita reler o CSV a cada grupo; se omitido, é lido aqui.
+    """
+    if df_agg_grupo.empty:
+        return pd.Series(dtype=float)
+
+    if pesos_qualidade is None:
+        pesos_qualidade = carregar_pesos_qualidade()
+    datas = df_agg_grupo['data'].to_numpy()
+    if pesos_qualidade:
+        peso = df_agg_grupo['data'].map(pesos_qualidade).fillna(1.0).to_numpy(dtype=np.float64)
+    else:
+        peso = np.ones(len(df_agg_grupo))
+
+    # Dados já estão agregados, só precisamos calcular a média (meses com peso de qualidade < 0.6 saem)
+    idx, media_salario = _serie_kernel(
+        df_agg_grupo['soma_salario_total'].to_numpy(dtype=np.float64),
+        df_agg_grupo['total_admissoes_total'].to_numpy(dtype=np.float64),
+        peso,
+        LIMIAR_QUALIDADE,
+    )
+    if idx.size == 0:
+        return pd.Series(dtype=float)
+
+    # Define o 'data' como índice para a série temporal: formato explícito 'YYYY-MM' (sem inferência do parser)
+    periodos = pd.PeriodIndex(
+        pd.to_datetime(pd.Series(datas[idx]), format='%Y-%m', cache=True).dt.to_period('M'), name='data'
+    )
+    return pd.Series(media_salario, index=periodos, name='media_salario')
 
 
-def _auto_arima_fallback(serie: pd.Series, seasonal: bool = False, m: int = 1):
+def _ajustar_sarimax(y: pd.Series, order: Tuple[int, int, int], seasonal_order: Tuple[int, int, int, int]):
     import warnings
     from statsmodels.tsa.statespace.sarimax import SARIMAX
     warnings.filterwarnings('ignore')
+    model = SARIMAX(y, order=order, seasonal_order=seasonal_order, enforce_stationarity=False, enforce_invertibility=False)
+    return model.fit(disp=False)
+
+
+def _aic_candidato(y: pd.Series, order: Tuple[int, int, int], seasonal_order: Tuple[int, int, int, int]) -> float:
+    try:
+        return float(_ajustar_sarimax(y, order, seasonal_order).aic)
+    except Exception:
+        return np.inf
+
+
+def _auto_arima_fallback(serie: pd.Series, seasonal: bool = False, m: int = 1, n_jobs: int = -1):
     y = serie.astype(float)
     y.index = pd.period_range(start=y.index[0].start_time, periods=len(y), freq='M')
-    best_aic = np.inf
-    best_res = None
     ps = range(0, 3); qs = range(0, 3); ds = range(0, 2)
+    candidatos = []
     for p in ps:
         for d in ds:
             for q in qs:
-                try:
-                    model = SARIMAX(y, order=(p, d, q), enforce_stationarity=False, enforce_invertibility=False)
-                    res = model.fit(disp=False)
-                    if res.aic < best_aic: best_aic, best_res = res.aic, res
-                    if seasonal and m > 1:
-                        model_s = SARIMAX(y, order=(p, d, q), seasonal_order=(1, 0, 1, m), enforce_stationarity=False, enforce_invertibility=False)
-                        res_s = model_s.fit(disp=False)
-                        if res_s.aic < best_aic: best_aic, best_res = res_s.aic, res_s
-                except Exception: continue
-    if best_res is None: raise RuntimeError('Falha no ajuste SARIMA fallback.')
-    return best_res
-
-
-def executar_projecao_salarial(
-    conn: sqlite3.Connection,
+                candidatos.append(((p, d, q), (0, 0, 0, 0)))
+                if seasonal and m > 1:
+                    candidatos.append(((p, d, q), (1, 0, 1, m)))
+    # Ajustes independentes: grade em paralelo (loky) quando joblib existe; só o AIC volta do worker
+    if HAS_JOBLIB and n_jobs != 1:
+        aics = Parallel(n_jobs=n_jobs, backend='loky')(delayed(_aic_candidato)(y, o, so) for o, so in candidatos)
+    else:
+        aics = [_aic_candidato(y, o, so) for o, so in candidatos]
+    aics = np.asarray(aics, dtype=np.float64)
+    # NaN/inf (ajuste que falhou) nunca vence
+    if not np.isfinite(aics).any(): raise RuntimeError('Falha no ajuste SARIMA fallback.')
+    best = int(np.nanargmin(aics))
+    # Reajusta só o melhor candidato no processo principal
+    return _ajustar_sarimax(y, *candidatos[best])
+
+
+def projetar_serie(
     filtro_tipo: str,
     filtro_valor: str,
     grupo_coluna_sql: str,
-    grupo_codigo: str,
     grupo_nome: str,
     serie_salarial: pd.Series,
     periodos: int = 60,
     alpha: float = 0.05,
-) -> None:
-    """Ajusta SARIMA sazonal para uma série salarial e salva resultados no banco."""
+    n_jobs_grade: int = -1,
+) -> Optional[pd.DataFrame]:
+    """Ajusta SARIMA sazonal para uma série salarial e devolve histórico + projeção (None se pulado).
+
+    Não toca no banco: pode rodar num worker do ProcessPoolExecutor.
+    """
     log_ctx = f'SARIMA ({filtro_tipo}={filtro_valor}, Grupo={grupo_nome})'
     
     if serie_salarial.empty or len(serie_salarial) < 24:
         logging.warning('[%s] Dados insuficientes para série temporal sazonal (< 24 meses). Pulando.', log_ctx)
-        return
+        return None
 
     logging.info('[%s] Série salarial calculada. Iniciando ajuste do modelo SARIMA (sazonal)...', log_ctx)
     try:
@@ -261,7 +429,7 @@ def executar_projecao_salarial(
             
         else:
             logging.info('[%s] Usando fallback (statsmodels) para auto-SARIMA.', log_ctx)
-            modelo_fit = _auto_arima_fallback(serie_salarial, seasonal=True, m=12)
+            modelo_fit = _auto_arima_fallback(serie_salarial, seasonal=True, m=12, n_jobs=n_jobs_grade)
             forecast_results = modelo_fit.get_forecast(steps=periodos)
             previsoes = forecast_results.predicted_mean
             conf_int = forecast_results.conf_int(alpha=alpha)
@@ -270,14 +438,15 @@ def executar_projecao_salarial(
 
     except Exception as exc:
         logging.error('[%s] Falha no ajuste SARIMA: %s. Pulando.', log_ctx, exc, exc_info=True)
-        return
+        return None
 
-    future_index = [serie_salarial.index[-1] + i for i in range(1, periodos + 1)]
+    # Conversões de data vetorizadas sobre o PeriodIndex (sem aritmética de Period por elemento)
+    future_index = pd.period_range(start=serie_salarial.index[-1] + 1, periods=periodos, freq='M')
 
     historico = pd.DataFrame({
         'filtro_tipo': filtro_tipo, 'filtro_valor': filtro_valor,
         'grupo_tipo': grupo_coluna_sql, 'grupo_valor': grupo_nome,
-        'data': [idx.to_timestamp().date() for idx in serie_salarial.index],
+        'data': serie_salarial.index.to_timestamp().date,
         'salario_real': serie_salarial.values,
         'salario_projetado': np.nan,
         'salario_projetado_low': np.nan,
@@ -289,24 +458,95 @@ def executar_projecao_salarial(
     futuro = pd.DataFrame({
         'filtro_tipo': filtro_tipo, 'filtro_valor': filtro_valor,
         'grupo_tipo': grupo_coluna_sql, 'grupo_valor': grupo_nome,
-        'data': [idx.to_timestamp().date() for idx in future_index],
+        'data': future_index.to_timestamp().date,
         'salario_real': np.nan,
         'salario_projetado': previsoes_np,
         'salario_projetado_low': conf_int_low,
         'salario_projetado_high': conf_int_high,
     })
 
-    resultado = pd.concat([historico, futuro], ignore_index=True)
+    return pd.concat([historico, futuro], ignore_index=True)
+
+
+PROJECOES_COLS = [
+    'filtro_tipo', 'filtro_valor', 'grupo_tipo', 'grupo_valor', 'data',
+    'salario_real', 'salario_projetado', 'salario_projetado_low', 'salario_projetado_high',
+]
+INSERT_PROJECOES_SQL = (
+    f"INSERT OR REPLACE INTO projecoes_salariais ({', '.join(PROJECOES_COLS)}) "
+    f"VALUES ({', '.join(['?'] * len(PROJECOES_COLS))})"
+)
+
+
+def _linhas_projecao(resultado: pd.DataFrame) -> List[tuple]:
+    """Tuplas prontas para executemany: datas em ISO (vetorizado) e NaN -> NULL."""
+    df = resultado[PROJECOES_COLS].copy()
+    df['data'] = pd.to_datetime(df['data']).dt.strftime('%Y-%m-%d')
+    df = df.astype(object).where(df.notna(), None)
+    return list(zip(*(df[c].tolist() for c in PROJECOES_COLS)))
+
+
+def salvar_projecao(
+    conn: sqlite3.Connection,
+    filtro_tipo: str,
+    filtro_valor: str,
+    grupo_coluna_sql: str,
+    grupo_nome: str,
+    resultado: pd.DataFrame,
+) -> None:
+    """Substitui no banco a projeção de um (cenário, grupo).
 
-    with conn:
+    DELETE e INSERT rodam na mesma transação: o DELETE remove datas que saíram do
+    horizonte (início ou número de períodos diferentes) e a PK composta
+    (cenário, grupo, data) atende tanto o DELETE quanto o INSERT OR REPLACE.
+    """
+    log_ctx = f'SARIMA ({filtro_tipo}={filtro_valor}, Grupo={grupo_nome})'
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
         conn.execute(
             'DELETE FROM projecoes_salariais WHERE filtro_tipo = ? AND filtro_valor = ? AND grupo_tipo = ? AND grupo_valor = ?',
             (filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome),
         )
-        resultado.to_sql('projecoes_salariais', conn, if_exists='append', index=False)
+        conn.executemany(INSERT_PROJECOES_SQL, _linhas_projecao(resultado))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     logging.info('[%s] Projeção SARIMA (Prognóstico + Cenários) salva com sucesso.', log_ctx)
 
 
+def executar_projecao_salarial(
+    conn: sqlite3.Connection,
+    filtro_tipo: str,
+    filtro_valor: str,
+    grupo_coluna_sql: str,
+    grupo_codigo: str,
+    grupo_nome: str,
+    serie_salarial: pd.Series,
+    periodos: int = 60,
+    alpha: float = 0.05,
+) -> None:
+    """Ajusta SARIMA sazonal para uma série salarial e salva resultados no banco."""
+    resultado = projetar_serie(filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, serie_salarial, periodos, alpha)
+    if resultado is not None:
+        salvar_projecao(conn, filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, resultado)
+
+
+def _projetar_tarefa(tarefa: Tuple[str, str, str, str, pd.Series], n_jobs_grade: int = 1) -> Optional[pd.DataFrame]:
+    """Um (cenário, grupo). No pool a grade do fallback roda serial: o paralelismo já é entre grupos."""
+    filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, serie_salarial = tarefa
+    try:
+        return projetar_serie(filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, serie_salarial, n_jobs_grade=n_jobs_grade)
+    except Exception as e:
+        logging.error(
+            'Falha crítica ao rodar SARIMA para (%s=%s, %s=%s): %s',
+            filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, e, exc_info=True
+        )
+        return None
+
+
 def executar_modelagem() -> None:
     """Orquestra regressão e projeções SARIMA."""
     if not DB_PATH.exists():
@@ -317,19 +557,26 @@ def executar_modelagem() -> None:
     with sqlite3.connect(DB_PATH) as conn:
         
         try:
-            df_reg = carregar_dados_para_regressao(conn)
-            rodar_regressao(df_reg, conn)
-            del df_reg # Libera memória
+            total_grupos = carregar_dados_para_regressao(conn)
+            rodar_regressao(total_grupos, conn)
         except Exception as e:
             logging.error('Falha crítica ao rodar Regressão: %s', e, exc_info=True)
 
         logging.info('Iniciando projeções SARIMA para %d cenários...', len(CENARIOS_ARIMA))
+        df_multi = None  # Varredura única compartilhada pelos grupos do cenário 'geral'
+        pesos_qualidade = carregar_pesos_qualidade()
+        tarefas: List[Tuple[str, str, str, str, pd.Series]] = []
         
         for filtro_tipo, filtro_valor in CENARIOS_ARIMA:
             for grupo_coluna_sql, grupos_codigo_lista in GRUPOS_DE_PROJECAO.items():
                 
                 try:
-                    df_agg_grupos = carregar_dados_para_arima(conn, filtro_tipo, filtro_valor, grupo_coluna_sql, grupos_codigo_lista)
+                    if filtro_tipo == 'geral':
+                        if df_multi is None:
+                            df_multi = load_agregado_multi(conn)
+                        df_agg_grupos = agregar_arima_de_multi(df_multi, grupo_coluna_sql, grupos_codigo_lista)
+                    else:
+                        df_agg_grupos = carregar_dados_para_arima(conn, filtro_tipo, filtro_valor, grupo_coluna_sql, grupos_codigo_lista)
                     if df_agg_grupos.empty:
                         logging.warning(f'[{filtro_tipo}={filtro_valor}] Sem dados para grupos {grupo_coluna_sql}. Pulando.')
                         continue
@@ -337,28 +584,45 @@ def executar_modelagem() -> None:
                     logging.error(f'Falha ao carregar dados SARIMA para {grupo_coluna_sql}: {e}')
                     continue
                 
+                # Particiona uma vez por grupo em vez de um filtro booleano por código
+                por_grupo = dict(tuple(df_agg_grupos.groupby('grupo_valor', sort=False)))
                 for grupo_codigo in grupos_codigo_lista:
                     grupo_nome = GRUPOS_MAP[grupo_coluna_sql].get(grupo_codigo, 'NA')
                     
-                    df_grupo_especifico = df_agg_grupos[df_agg_grupos['grupo_valor'] == grupo_codigo]
+                    df_grupo_especifico = por_grupo.get(grupo_codigo, df_agg_grupos.iloc[0:0])
                     
                     try:
-                        serie_salarial = calcular_serie_salarial(df_grupo_especifico)
-                        executar_projecao_salarial(
-                            conn, filtro_tipo, filtro_valor, 
-                            grupo_coluna_sql, grupo_codigo, grupo_nome, # (correção de bug)
-                            serie_salarial
-                        )
+                        serie_salarial = calcular_serie_salarial(df_grupo_especifico, pesos_qualidade)
+                        tarefas.append((filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, serie_salarial))
                     except Exception as e:
                         logging.error(
                             'Falha crítica ao rodar SARIMA para (%s=%s, %s=%s): %s',
                             filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, e, exc_info=True
                         )
+
+        # Ajustes SARIMA independentes: um processo por (cenário, grupo); gravação no banco só no pai
+        if MAX_WORKERS_SARIMA > 1 and len(tarefas) > 1:
+            with ProcessPoolExecutor(max_workers=min(MAX_WORKERS_SARIMA, len(tarefas))) as ex:
+                resultados = list(ex.map(_projetar_tarefa, tarefas))
+        else:
+            resultados = [_projetar_tarefa(tarefa, n_jobs_grade=-1) for tarefa in tarefas]
+
+        for (filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, _), resultado in zip(tarefas, resultados):
+            if resultado is None:
+                continue
+            try:
+                salvar_projecao(conn, filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, resultado)
+            except Exception as e:
+                logging.error(
+                    'Falha crítica ao rodar SARIMA para (%s=%s, %s=%s): %s',
+                    filtro_tipo, filtro_valor, grupo_coluna_sql, grupo_nome, e, exc_info=True
+                )
         
         logging.info('Processo de modelagem concluído.')
 
 
 def main() -> None:
+    configurar_logging()
     executar_modelagem()
 
 
@@ -1,20 +1,55 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Dict
+import csv
+import functools
 import os
+import shutil
 import sqlite3
 import sys
 import time
 
+import numpy as np
 import pandas as pd
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import pyarrow.parquet as pq
 
+try:
+    import duckdb
+    HAS_DUCKDB = True
+except Exception:
+    HAS_DUCKDB = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except Exception:
+    HAS_NUMBA = False
+
 
 BASE_DIR = Path(__file__).parent
 CLEAN_FOLDER = BASE_DIR / 'CAGED_limpos'
 OUTPUT_FOLDER = BASE_DIR / 'output_final'
 STAGING_DIR = OUTPUT_FOLDER / 'tmp_aggs'
 STAGING_DB = STAGING_DIR / 'aggs_temp.db'
-OUTPUT_FILE = OUTPUT_FOLDER / 'dados_agregados.parquet'
+OUTPUT_DATASET = OUTPUT_FOLDER / 'dados_agregados'  # Parquet particionado (hive) por data: data=YYYY-MM/
+CSV_BLOCK_SIZE = 1 << 24  # 16MB por bloco/lote do leitor CSV do pyarrow
+_ARROW_STRING = {pa.string(): pd.StringDtype('pyarrow')}
+MAX_WORKERS = os.cpu_count() or 1  # Processos na agregação por arquivo (caminho DuckDB); 1 = serial
+
+
+def _memoria_fisica_mb() -> int | None:
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1 << 20)
+    except (AttributeError, ValueError, OSError):
+        return None  # sysconf indisponível (Windows)
+
+
+# Orçamento total do DuckDB, dividido entre os workers: cada processo assumiria sozinho 80% da RAM
+DUCKDB_MEMORIA_MB = int((_memoria_fisica_mb() or 8192) * 0.8)
 
 AGG_KEYS = [
     'data',
@@ -25,14 +60,30 @@ AGG_KEYS = [
     'raca_cor',
     'tipodedeficiência',  # NOVO
 ]
+EXPORT_BATCH_ROWS = 8192  # Linhas por fetchmany/RecordBatch (~L2 por lote com ~10 colunas)
+EXPORT_ROW_GROUP_ROWS = 524_288  # Linhas por row group do Parquet final (64 lotes)
+
+# Schema final com SOMAS, declarado uma vez (sem inferência do pandas na exportação)
+SCHEMA_SAIDA = pa.schema(
+    [pa.field(c, pa.string()) for c in AGG_KEYS]
+    + [
+        pa.field('soma_salario', pa.float64()),
+        pa.field('soma_idade', pa.float64()),
+        pa.field('total_admissoes', pa.int64()),
+    ]
+)
 
 
 def _prepare_sqlite(conn: sqlite3.Connection) -> None:
     cur = conn.cursor()
+    # page_size só vale antes da primeira tabela (e antes de entrar em WAL); linhas largas de 7 TEXTs cabem em menos páginas
+    cur.execute('PRAGMA page_size = 32768;')
     cur.execute('PRAGMA journal_mode = WAL;')
-    cur.execute('PRAGMA synchronous = OFF;')
+    cur.execute('PRAGMA synchronous = NORMAL;')  # Em WAL, NORMAL mantém a proteção contra escrita parcial quase sem custo
     cur.execute('PRAGMA temp_store = MEMORY;')
     cur.execute('PRAGMA cache_size = -100000;')  # ~100MB cache
+    cur.execute('PRAGMA mmap_size = 30000000000;')  # Limitado pelo teto de compilação do SQLite
+    cur.execute('PRAGMA wal_autocheckpoint = 10000;')  # Checkpoints menos frequentes durante a carga
     cur.execute(
         f"""
         CREATE TABLE IF NOT EXISTS aggs (
@@ -46,7 +97,26 @@ def _prepare_sqlite(conn: sqlite3.Connection) -> None:
             sum_salario REAL NOT NULL,
             sum_idade REAL NOT NULL,
             n INTEGER NOT NULL,
-            PRIMARY KEY ({', '.join(AGG_KEYS)})
+            -- UNIQUE em vez de PRIMARY KEY: a tabela fica num heap por ROWID (linhas estreitas na leitura)
+            -- e o índice largo de 7 TEXTs só serve ao ON CONFLICT e ao filtro por data da exportação
+            UNIQUE ({', '.join(AGG_KEYS)})
+        )
+        """
+    )
+    # Área temporária de cada chunk: carga em massa sem PK e um único INSERT ... SELECT faz o merge
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS aggs_chunk (
+            data TEXT,
+            municipio TEXT,
+            cnae20subclasse TEXT,
+            grau_instrucao TEXT,
+            genero TEXT,
+            raca_cor TEXT,
+            "tipodedeficiência" TEXT,
+            sum_salario REAL,
+            sum_idade REAL,
+            n INTEGER
         )
         """
     )
@@ -56,43 +126,236 @@ def _prepare_sqlite(conn: sqlite3.Connection) -> None:
 def _merge_chunk_into_sqlite(conn: sqlite3.Connection, df_chunk_grp: pd.DataFrame) -> None:
     if df_chunk_grp.empty:
         return
-    df_chunk_grp = df_chunk_grp.reset_index()
-    sql = (
+    cols = AGG_KEYS + ['sum_salario', 'sum_idade', 'n']
+    # Chaves direto dos níveis do MultiIndex e valores das colunas, sem a cópia de um reset_index
+    index = df_chunk_grp.index
+    colunas = [index.get_level_values(i).astype(object).tolist() for i in range(index.nlevels)]
+    colunas += [df_chunk_grp[c].tolist() for c in ('sum_salario', 'sum_idade', 'n')]
+    records = list(zip(*colunas))
+    conn.execute('DELETE FROM temp.aggs_chunk')
+    conn.executemany(
+        f"INSERT INTO temp.aggs_chunk VALUES ({', '.join(['?'] * len(cols))})",
+        records,
+    )
+    # 'WHERE true' desfaz a ambiguidade do parser entre ON CONFLICT e um JOIN ... ON.
+    # NULL é distinto de NULL no UNIQUE: chaves ausentes viram '' para o upsert casar (a exportação desfaz)
+    conn.execute(
         'INSERT INTO aggs ('
-        + ', '.join(AGG_KEYS)
-        + ', sum_salario, sum_idade, n) VALUES ('
-        + ', '.join(['?'] * (len(AGG_KEYS) + 3))
-        + ') ON CONFLICT('
+        + ', '.join(cols)
+        + ') SELECT '
+        + ', '.join([f"COALESCE({k}, '')" for k in AGG_KEYS] + ['sum_salario', 'sum_idade', 'n'])
+        + ' FROM temp.aggs_chunk WHERE true ON CONFLICT('
         + ', '.join(AGG_KEYS)
         + ') DO UPDATE SET '
         'sum_salario = sum_salario + excluded.sum_salario, '
         'sum_idade = sum_idade + excluded.sum_idade, '
         'n = n + excluded.n'
     )
-    cols = AGG_KEYS + ['sum_salario', 'sum_idade', 'n']
-    records = list(df_chunk_grp[cols].itertuples(index=False, name=None))
-    conn.executemany(sql, records)
 
 
-def agregar_arquivo(csv_path: Path, conn: sqlite3.Connection, chunksize: int = 500_000) -> None:
-    start_file = time.time()
-    print(f'Iniciando: {csv_path.name}')
-    def _detectar_col_deficiencia(path: Path) -> str | None:
-        import csv
-        try:
-            with path.open('r', encoding='utf-8', errors='ignore') as f:
-                reader = csv.reader(f)
-                header = next(reader)
-                header_norm = [h.strip().lower() for h in header]
-        except Exception:
-            return None
-        candidates = ['tipodedeficiência', 'tipodedeficiencia', 'tipo_deficiencia', 'deficiencia']
-        for cand in candidates:
-            if cand.lower() in header_norm:
-                # retorna o nome como aparece no arquivo original
-                return header[header_norm.index(cand.lower())]
+def _chave_categorica(coluna: pd.Series) -> pd.Categorical:
+    """strip + dictionary-encode de uma chave. Se a coluna já é category (Parquet), o trim roda só no dicionário."""
+    if isinstance(coluna.dtype, pd.CategoricalDtype):
+        categorias = pc.utf8_trim_whitespace(pa.array(coluna.cat.categories.astype(str), type=pa.string()))
+        # Categorias que colidem após o trim viram uma só; -1 (NaN) continua -1
+        inversa, unicas = pd.factorize(np.asarray(categorias.to_pylist(), dtype=object))
+        mapa = np.append(inversa, -1)
+        return pd.Categorical.from_codes(mapa[coluna.cat.codes.to_numpy()], categories=unicas)
+    arr = pc.utf8_trim_whitespace(pa.array(coluna.astype(str), type=pa.string()))
+    return arr.dictionary_encode().to_pandas().values
+
+
+def _somar_grupos_np(grupos, salario, idade, n_grupos):
+    return (
+        np.bincount(grupos, weights=salario, minlength=n_grupos),
+        np.bincount(grupos, weights=idade, minlength=n_grupos),
+        np.bincount(grupos, minlength=n_grupos),
+    )
+
+
+if HAS_NUMBA:
+    @njit(cache=True)
+    def _somar_grupos(grupos, salario, idade, n_grupos):
+        # Uma passada sobre as linhas acumulando as três somas (serial: scatter em paralelo teria corrida)
+        sum_salario = np.zeros(n_grupos)
+        sum_idade = np.zeros(n_grupos)
+        n = np.zeros(n_grupos, np.int64)
+        for i in range(grupos.size):
+            g = grupos[i]
+            sum_salario[g] += salario[i]
+            sum_idade[g] += idade[i]
+            n[g] += 1
+        return sum_salario, sum_idade, n
+else:
+    _somar_grupos = _somar_grupos_np
+
+
+def _agrupar_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """Equivalente a groupby(AGG_KEYS, observed=True, dropna=False) com sum/sum/count, sobre os códigos das categorias.
+
+    Os códigos das 7 chaves viram um único inteiro (ravel_multi_index), fatorado por hash; as somas saem do kernel.
+    """
+    cats = [chunk[c].cat for c in AGG_KEYS]
+    codigos = [c.codes.to_numpy().astype(np.int64) + 1 for c in cats]  # +1: NaN (-1) vira 0 e forma grupo próprio
+    dims = [len(c.categories) + 1 for c in cats]
+    grupos, chaves = pd.factorize(np.ravel_multi_index(codigos, dims), sort=False)
+    sum_salario, sum_idade, n = _somar_grupos(
+        grupos.astype(np.int64),
+        chunk['salario'].to_numpy(dtype=np.float64),
+        chunk['idade'].to_numpy(dtype=np.float64),
+        len(chaves),
+    )
+    niveis = np.unravel_index(chaves, dims)
+    index = pd.MultiIndex.from_arrays(
+        [pd.Categorical.from_codes(nivel - 1, categories=c.categories) for nivel, c in zip(niveis, cats)],
+        names=AGG_KEYS,
+    )
+    return pd.DataFrame({'sum_salario': sum_salario, 'sum_idade': sum_idade, 'n': n}, index=index)
+
+
+def _acumular(acumulado: Dict[tuple, list], df_chunk_grp: pd.DataFrame) -> None:
+    # Uma operação de dict por grupo do chunk (já agregado), não por linha; NaN vira None para a chave ser estável
+    index = df_chunk_grp.index
+    niveis = []
+    for i in range(index.nlevels):
+        nivel = index.get_level_values(i)
+        niveis.append(nivel.astype(object).where(nivel.notna(), None).tolist())
+    somas = zip(df_chunk_grp['sum_salario'].tolist(), df_chunk_grp['sum_idade'].tolist(), df_chunk_grp['n'].tolist())
+    for chave, (sum_salario, sum_idade, n) in zip(zip(*niveis), somas):
+        acc = acumulado[chave]
+        acc[0] += sum_salario
+        acc[1] += sum_idade
+        acc[2] += n
+
+
+def _acumulado_para_df(acumulado: Dict[tuple, list]) -> pd.DataFrame:
+    valores = np.array(list(acumulado.values()), dtype=np.float64)
+    index = pd.MultiIndex.from_tuples(list(acumulado), names=AGG_KEYS)
+    return pd.DataFrame(
+        {'sum_salario': valores[:, 0], 'sum_idade': valores[:, 1], 'n': valores[:, 2].astype(np.int64)},
+        index=index,
+    )
+
+
+def _gravar_shard(df_chunk_grp: pd.DataFrame, nome: str) -> None:
+    # Staging append-only: cada arquivo agregado vira um Parquet; a soma final é um único GROUP BY no DuckDB
+    if df_chunk_grp.empty:
+        return
+    table = pa.Table.from_pandas(df_chunk_grp.reset_index(), preserve_index=False)
+    pq.write_table(table, STAGING_DIR / f'part-{nome}.parquet', compression='snappy')
+
+
+def _limpar_shards() -> None:
+    for shard in STAGING_DIR.glob('part-*.parquet'):
+        shard.unlink()
+
+
+def _iter_chunks(path: Path, usecols: list, chunksize: int):
+    # Parquet (saída atual do converterCSV) em lotes; CSV legado mantido como fallback
+    if path.suffix == '.parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=usecols):
+            yield batch.to_pandas()
+        return
+    # CSV legado: leitor colunar do pyarrow em streaming, um RecordBatch por chunk.
+    # Tudo como texto: preserva zeros à esquerda nos códigos; idade/salário são convertidos depois, com coerção.
+    reader = pacsv.open_csv(
+        path,
+        read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        parse_options=pacsv.ParseOptions(invalid_row_handler=lambda _row: 'skip'),  # = on_bad_lines='skip'
+        convert_options=pacsv.ConvertOptions(
+            include_columns=usecols,
+            column_types={c: pa.string() for c in usecols},
+        ),
+    )
+    for batch in reader:
+        yield batch.to_pandas(types_mapper=_ARROW_STRING.get)
+
+
+@functools.lru_cache(maxsize=None)
+def _col_deficiencia_do_cabecalho(header: tuple) -> str | None:
+    # Poucas grafias possíveis e estáveis por ano de publicação: a busca roda uma vez por cabeçalho distinto
+    header_norm = [h.strip().lower() for h in header]
+    candidates = ['tipodedeficiência', 'tipodedeficiencia', 'tipo_deficiencia', 'deficiencia']
+    for cand in candidates:
+        if cand.lower() in header_norm:
+            # retorna o nome como aparece no arquivo original
+            return header[header_norm.index(cand.lower())]
+    return None
+
+
+def _detectar_col_deficiencia(path: Path) -> str | None:
+    try:
+        if path.suffix == '.parquet':
+            header = pq.read_schema(path).names  # Só o rodapé do arquivo
+        else:
+            # Só a primeira linha, em bytes; o csv.reader trata apenas ela (aspas/separadores)
+            with path.open('rb') as f:
+                primeira = f.readline().decode('utf-8', errors='ignore')
+            header = next(csv.reader([primeira]))
+    except Exception:
         return None
+    return _col_deficiencia_do_cabecalho(tuple(header))
+
+
+def agregar_arquivo_duckdb(parquet_path: Path, threads: int | None = None, memoria_mb: int | None = None) -> None:
+    """Agrega um Parquet limpo inteiro no DuckDB (filtros + GROUP BY vetorizados), gravando um shard.
 
+    `threads` e `memoria_mb` limitam threads e memory_limit do DuckDB quando vários arquivos rodam em
+    paralelo (evita oversubscription de CPU e que a soma dos workers estoure a RAM).
+    """
+    start_file = time.time()
+    print(f'Iniciando (DuckDB): {parquet_path.name}')
+    col_def_src = _detectar_col_deficiencia(parquet_path)
+
+    def texto(coluna: str) -> str:
+        return f'TRIM(CAST("{coluna}" AS VARCHAR))'
+
+    def_sql = texto(col_def_src) if col_def_src else "'9'"
+    chaves = ', '.join(f'"{c}"' for c in AGG_KEYS)
+    origem = parquet_path.as_posix()
+    destino = (STAGING_DIR / f'part-{parquet_path.stem}.parquet').as_posix()
+    con = duckdb.connect()
+    try:
+        if threads:
+            con.execute(f'SET threads = {int(threads)}')
+        if memoria_mb:
+            con.execute(f"SET memory_limit = '{int(memoria_mb)}MB'")
+        con.execute(
+            f"""
+            COPY (
+                SELECT {chaves},
+                       SUM(salario) AS sum_salario,
+                       SUM(idade) AS sum_idade,
+                       COUNT(*) AS n
+                FROM (
+                    SELECT strftime(try_strptime({texto('competencia_mov')}, '%Y%m'), '%Y-%m') AS data,
+                           {texto('municipio')} AS municipio,
+                           {texto('cnae20subclasse')} AS cnae20subclasse,
+                           {texto('grau_instrucao')} AS grau_instrucao,
+                           {texto('genero')} AS genero,
+                           {texto('raca_cor')} AS raca_cor,
+                           {def_sql} AS "tipodedeficiência",
+                           TRY_CAST(salario AS DOUBLE) AS salario,
+                           TRY_CAST(idade AS DOUBLE) AS idade
+                    FROM read_parquet('{origem}')
+                )
+                -- Filtros de qualidade / outliers básicos (mesmos do caminho pandas)
+                WHERE data IS NOT NULL
+                  AND idade BETWEEN 14 AND 80
+                  AND salario > 0 AND salario < 200000
+                GROUP BY {chaves}
+            ) TO '{destino}' (FORMAT PARQUET, COMPRESSION SNAPPY)
+            """
+        )
+    finally:
+        con.close()
+    print(f'Concluído: {parquet_path.name} | tempo={time.time()-start_file:,.1f}s')
+
+
+def agregar_arquivo(csv_path: Path, conn: sqlite3.Connection | None, chunksize: int = 500_000) -> None:
+    """Agrega um arquivo limpo em chunks; sem `conn`, grava um shard Parquet em STAGING_DIR (caminho DuckDB)."""
+    start_file = time.time()
+    print(f'Iniciando: {csv_path.name}')
     col_def_src = _detectar_col_deficiencia(csv_path)
 
     usecols = [
@@ -109,78 +372,92 @@ def agregar_arquivo(csv_path: Path, conn: sqlite3.Connection, chunksize: int = 5
     chunk_idx = 0
     total_rows_in = 0
     total_groups = 0
-    for chunk in pd.read_csv(
-        csv_path,
-        usecols=usecols,
-        dtype={
-            'competencia_mov': str,
-            'municipio': str,
-            'cnae20subclasse': str,
-            # 'cbo2002ocupacao': str, # REMOVIDO
-            'grau_instrucao': str,
-            'genero': str,
-            'raca_cor': str,
-        },
-        chunksize=chunksize,
-        engine='python',
-        on_bad_lines='skip',
-    ):
+    # Somas do arquivo inteiro num dict: um único merge/shard por arquivo em vez de um por chunk
+    acumulado: Dict[tuple, list] = defaultdict(lambda: [0.0, 0.0, 0])
+    for chunk in _iter_chunks(csv_path, usecols, chunksize):
         chunk_idx += 1
         rows_in = len(chunk)
         total_rows_in += rows_in
 
         chunk['competencia_mov'] = chunk['competencia_mov'].astype(str).str.strip()
-        chunk['data'] = (
-            pd.to_datetime(chunk['competencia_mov'], format='%Y%m', errors='coerce')
-            .dt.strftime('%Y-%m')
-        )
+        # 'YYYYMM' -> 'YYYY-MM' por fatiamento de string (sem datetime64/strftime); inválidos viram NaN
+        competencia = chunk['competencia_mov'].str
+        valida = competencia.fullmatch(r'\d{4}(0[1-9]|1[0-2])')
+        chunk['data'] = (competencia.slice(0, 4) + '-' + competencia.slice(4, 6)).where(valida)
         # Normaliza e converte idade/salário, aceitando formatos com vírgula
         chunk['idade'] = pd.to_numeric(chunk['idade'], errors='coerce')
         if chunk['salario'].dtype.kind in {'O', 'U'}:
-            chunk['salario'] = (
-                chunk['salario'].astype(str)
-                .str.replace('.', '', regex=False)
-                .str.replace(',', '.', regex=False)
-            )
+            # Formato brasileiro ('1.234,56'): salários se repetem muito (piso, valores redondos), então
+            # normaliza/converte só o dicionário de valores distintos e espalha pelos índices.
+            # Só valores com vírgula passam pela troca: '1500.50' (ponto decimal) segue como está.
+            salario = pa.array(chunk['salario'].astype(str), type=pa.string()).dictionary_encode()
+            unicos = salario.dictionary
+            brasileiro = pc.replace_substring(pc.replace_substring(unicos, '.', ''), ',', '.')
+            unicos = pc.if_else(pc.match_substring(unicos, ','), brasileiro, unicos)
+            valores = pd.to_numeric(unicos.to_pandas(), errors='coerce').to_numpy(dtype=np.float64)
+            chunk['salario'] = valores[salario.indices.to_numpy()]  # posicional: o índice do chunk não começa em 0
         chunk['salario'] = pd.to_numeric(chunk['salario'], errors='coerce')
         chunk = chunk.dropna(subset=['data', 'salario', 'idade'])
 
         # Filtros de qualidade / outliers básicos
         chunk = chunk[(chunk['idade'] >= 14) & (chunk['idade'] <= 80)]
         chunk = chunk[(chunk['salario'] > 0) & (chunk['salario'] < 200_000)]
+        # competencia_mov já virou 'data'; idade (14–80) cabe em int8. Salário fica float64: as somas por grupo
+        # acumulam no dtype da coluna e float32 perderia centavos em grupos grandes.
+        chunk = chunk.drop(columns=['competencia_mov'])
+        chunk['idade'] = chunk['idade'].astype('int8')
 
         if col_def_src and col_def_src in chunk.columns:
-            chunk['tipodedeficiência'] = chunk[col_def_src].astype(str).str.strip()
+            chunk['tipodedeficiência'] = chunk[col_def_src]
         else:
             chunk['tipodedeficiência'] = '9'
 
-        key_cols = ['municipio', 'cnae20subclasse', 'grau_instrucao', 'genero', 'raca_cor', 'tipodedeficiência']
-        for col in key_cols:
-            chunk[col] = chunk[col].astype(str).str.strip()
+        # Chaves como category (o agrupamento trabalha sobre códigos inteiros), com strip feito pelo pyarrow
+        for col in AGG_KEYS:
+            chunk[col] = _chave_categorica(chunk[col])
 
-        grp = chunk.groupby(AGG_KEYS, dropna=False).agg(
-            sum_salario=('salario', 'sum'),
-            sum_idade=('idade', 'sum'),
-            n=('salario', 'count'),
-        )
+        # Só combinações observadas, sem ordenação: o merge posterior não depende da ordem
+        grp = _agrupar_chunk(chunk)
         total_groups += len(grp)
 
-        _merge_chunk_into_sqlite(conn, grp)
+        _acumular(acumulado, grp)
         print(f'   Chunk {chunk_idx:>3}: linhas={rows_in:,} grupos={len(grp):,}')
         del chunk
         del grp
 
+    if acumulado:
+        grp = _acumulado_para_df(acumulado)
+        if conn is None:
+            _gravar_shard(grp, csv_path.stem)
+        else:
+            _merge_chunk_into_sqlite(conn, grp)
     print(
-        f'Concluído: {csv_path.name} | linhas totais={total_rows_in:,} grupos agregados~={total_groups:,} | tempo={time.time()-start_file:,.1f}s'
+        f'Concluído: {csv_path.name} | linhas totais={total_rows_in:,} grupos agregados~={total_groups:,} '
+        f'(distintos no arquivo={len(acumulado):,}) | tempo={time.time()-start_file:,.1f}s'
     )
 
 
+def _agregar_tarefa(path: Path, threads: int | None = None, memoria_mb: int | None = None) -> str:
+    """Um arquivo -> um shard em STAGING_DIR; independente dos demais, roda num worker do pool."""
+    # Parquet vai inteiro para o DuckDB; CSV legado ainda passa pelo pandas em chunks
+    if path.suffix == '.parquet':
+        agregar_arquivo_duckdb(path, threads, memoria_mb)
+    else:
+        agregar_arquivo(path, None)
+    return path.name
+
+
 def processar_incremental() -> None:
     # Permite testes com subconjunto de meses via variável de ambiente: IPP_TEST_MESES="202105,202106,202203"
     meses_env = os.environ.get('IPP_TEST_MESES', '').strip()
     meses_filtro = [m.strip() for m in meses_env.split(',') if m.strip().isdigit()] if meses_env else []
 
-    arquivos_csv = sorted(CLEAN_FOLDER.glob('*.csv'))
+    # Prefere o .parquet; .csv só para meses limpos antes da troca de formato
+    arquivos_parquet = sorted(CLEAN_FOLDER.glob('*.parquet'))
+    stems_parquet = {p.stem for p in arquivos_parquet}
+    arquivos_csv = sorted(
+        arquivos_parquet + [p for p in CLEAN_FOLDER.glob('*.csv') if p.stem not in stems_parquet]
+    )
     if meses_filtro:
         arquivos_csv = [p for p in arquivos_csv if any(m in p.stem for m in meses_filtro)]
     if not arquivos_csv:
@@ -188,13 +465,31 @@ def processar_incremental() -> None:
 
     OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
     STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    _limpar_shards()
     if STAGING_DB.exists():
         STAGING_DB.unlink()
 
+    total_files = len(arquivos_csv)
+    if HAS_DUCKDB:
+        workers = min(MAX_WORKERS, total_files)
+        print(f'Total de arquivos a processar: {total_files} (staging em Parquet + DuckDB, {workers} processo(s))')
+        if workers <= 1:
+            for i, csv_path in enumerate(arquivos_csv, start=1):
+                print(f'[{i}/{total_files}] {csv_path.name}')
+                _agregar_tarefa(csv_path)
+            return None
+        # Arquivos mensais são independentes: um worker por arquivo, cada um gravando seus shards
+        memoria_mb = max(DUCKDB_MEMORIA_MB // workers, 256)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futuros = [pool.submit(_agregar_tarefa, csv_path, 1, memoria_mb) for csv_path in arquivos_csv]
+            for i, futuro in enumerate(as_completed(futuros), start=1):
+                print(f'[{i}/{total_files}] {futuro.result()} concluído')
+        return None
+
+    # Fallback sem DuckDB: staging com upsert no SQLite
     with sqlite3.connect(STAGING_DB) as conn:
         _prepare_sqlite(conn)
 
-        total_files = len(arquivos_csv)
         print(f'Total de arquivos a processar: {total_files}')
         for i, csv_path in enumerate(arquivos_csv, start=1):
             print(f'[{i}/{total_files}] {csv_path.name}')
@@ -204,63 +499,120 @@ def processar_incremental() -> None:
 
     return None
 
+def _preparar_dataset_saida() -> None:
+    if OUTPUT_DATASET.exists():
+        shutil.rmtree(OUTPUT_DATASET)
+    OUTPUT_DATASET.mkdir(parents=True)
+
+
+def _exportar_parquet_vazio() -> None:
+    # Sem partições: um arquivo vazio na raiz com as demais colunas ('data' é a coluna de partição)
+    _preparar_dataset_saida()
+    schema = SCHEMA_SAIDA.remove(SCHEMA_SAIDA.get_field_index('data'))
+    pq.write_table(schema.empty_table(), OUTPUT_DATASET / 'part-vazio.parquet')
+    print('Nenhuma linha agregada. Parquet vazio gerado.')
+
+
+def exportar_duckdb_para_parquet() -> None:
+    """Soma os shards de STAGING_DIR num único GROUP BY vetorizado do DuckDB e grava o dataset final por data."""
+    if not any(STAGING_DIR.glob('part-*.parquet')):
+        _exportar_parquet_vazio()
+        return
+    _preparar_dataset_saida()
+    t0 = time.time()
+    chaves = ', '.join(f'"{c}"' for c in AGG_KEYS)
+    shards = (STAGING_DIR / 'part-*.parquet').as_posix()
+    destino = OUTPUT_DATASET.as_posix()
+    con = duckdb.connect()
+    try:
+        con.execute(
+            f"""
+            COPY (
+                SELECT {chaves},
+                       SUM(sum_salario) AS soma_salario,
+                       SUM(sum_idade) AS soma_idade,
+                       CAST(SUM(n) AS BIGINT) AS total_admissoes
+                FROM read_parquet('{shards}', union_by_name = true)
+                GROUP BY {chaves}
+            ) TO '{destino}' (
+                FORMAT PARQUET, PARTITION_BY (data), OVERWRITE_OR_IGNORE,
+                COMPRESSION ZSTD, ROW_GROUP_SIZE {EXPORT_ROW_GROUP_ROWS}
+            )
+            """
+        )
+        total = con.execute(f"SELECT COUNT(*) FROM read_parquet('{destino}/**/*.parquet')").fetchone()[0]
+    finally:
+        con.close()
+    print(f'Parquet salvo em: {OUTPUT_DATASET} | linhas: {total:,} | tempo: {time.time()-t0:,.1f}s')
+
+
 def exportar_streaming_para_parquet() -> None:
     """
     (CORRIGIDO v6)
-    Exporta os dados agregados (SOMAS) para um arquivo Parquet final.
+    Exporta os dados agregados (SOMAS) para o dataset Parquet final, particionado por data.
     Não calcula mais as médias aqui.
     """
-    OUTPUT_FOLDER.mkdir(parents=True, exist_ok=True)
+    if HAS_DUCKDB:
+        exportar_duckdb_para_parquet()
+        return
     with sqlite3.connect(STAGING_DB) as conn:
         cur = conn.cursor()
         cur.execute('SELECT COUNT(*) FROM aggs')
         total = cur.fetchone()[0] or 0
         if total == 0:
-            # Schema final com SOMAS
-            df_vazio = pd.DataFrame(columns=AGG_KEYS + ['soma_salario', 'soma_idade', 'total_admissoes'])
-            table = pa.Table.from_pandas(df_vazio, preserve_index=False)
-            pq.write_table(table, OUTPUT_FILE)
-            print('Nenhuma linha agregada. Parquet vazio gerado.')
+            _exportar_parquet_vazio()
             return
 
-        cols = ', '.join(AGG_KEYS)
-        query = f'SELECT {cols}, sum_salario, sum_idade, n FROM aggs'
-        cur.execute(query)
+        # Uma partição por mês: 'WHERE data = ?' usa o prefixo do UNIQUE (data primeiro) e lê só as linhas do mês
+        meses = [r[0] for r in conn.execute('SELECT DISTINCT data FROM aggs ORDER BY data')]
+        cols = ', '.join(f"NULLIF({k}, '') AS {k}" for k in AGG_KEYS if k != 'data')
+        schema_particao = SCHEMA_SAIDA.remove(SCHEMA_SAIDA.get_field_index('data'))
 
-        writer = None
+        _preparar_dataset_saida()
         processed = 0
-        batch_size = 100_000
         t0 = time.time()
-        while True:
-            rows = cur.fetchmany(batch_size)
-            if not rows:
-                break
-            
-            # Renomeia 'n' para 'total_admissoes'
-            df = pd.DataFrame(rows, columns=AGG_KEYS + ['soma_salario', 'soma_idade', 'total_admissoes'])
-            
-            # Garante a ordem correta das colunas
-            df = df[AGG_KEYS + ['soma_salario', 'soma_idade', 'total_admissoes']]
-
-            table = pa.Table.from_pandas(df, preserve_index=False)
-            if writer is None:
-                writer = pq.ParquetWriter(OUTPUT_FILE, table.schema, compression='snappy')
-            writer.write_table(table)
-
-            processed += len(df)
+        for mes in meses:
+            cur.execute(f'SELECT {cols}, sum_salario, sum_idade, n FROM aggs WHERE data = ?', (mes,))
+            destino = OUTPUT_DATASET / f'data={mes}'
+            destino.mkdir()
+            writer = pq.ParquetWriter(
+                destino / 'part-0.parquet', schema_particao, compression='zstd', compression_level=3
+            )
+            pendentes: list = []
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH_ROWS)
+                if not rows:
+                    break
+
+                # Linhas -> colunas direto em Arrow (sum_salario, sum_idade, n viram as colunas de SOMAS)
+                colunas = list(zip(*rows))
+                batch = pa.record_batch(
+                    [pa.array(col, type=field.type) for col, field in zip(colunas, schema_particao)],
+                    schema=schema_particao,
+                )
+                pendentes.append(batch)
+                processed += len(rows)
+
+                # Lotes pequenos (cache-friendly) na conversão; row groups grandes no arquivo (compressão)
+                if sum(len(b) for b in pendentes) >= EXPORT_ROW_GROUP_ROWS:
+                    writer.write_table(pa.Table.from_batches(pendentes), row_group_size=EXPORT_ROW_GROUP_ROWS)
+                    pendentes = []
+
+            if pendentes:
+                writer.write_table(pa.Table.from_batches(pendentes), row_group_size=EXPORT_ROW_GROUP_ROWS)
+            writer.close()
             perc = (processed / total) * 100 if total else 100
-            print(f'   Exportados {processed:,}/{total:,} ({perc:5.1f}%) em {time.time()-t0:,.1f}s')
+            print(f'   Exportados {processed:,}/{total:,} ({perc:5.1f}%) até {mes} em {time.time()-t0:,.1f}s')
 
-        if writer is not None:
-            writer.close()
-        print(f'Parquet salvo em: {OUTPUT_FILE} | linhas: {processed:,} | tempo: {time.time()-t0:,.1f}s')
+        print(f'Parquet salvo em: {OUTPUT_DATASET} | linhas: {processed:,} | tempo: {time.time()-t0:,.1f}s')
 
 
 def main() -> None:
     t0 = time.time()
     processar_incremental()
     exportar_streaming_para_parquet()
-    # Limpa o banco de dados temporário
+    # Limpa os shards e o banco de dados temporário
+    _limpar_shards()
     if STAGING_DB.exists():
         try:
             STAGING_DB.unlink()
@@ -2,26 +2,47 @@ import sqlite3
 from pathlib import Path
 from time import perf_counter
 
-import pandas as pd
-import pyarrow.parquet as pq
+import pyarrow as pa
+import pyarrow.dataset as ds
 
 BASE_DIR = Path(__file__).parent
 DB_PATH = BASE_DIR / 'projeto_caged.db'
-AGG_PATH = BASE_DIR / 'output_final' / 'dados_agregados.parquet'
+AGG_PATH = BASE_DIR / 'output_final' / 'dados_agregados'  # Dataset particionado por data (data=YYYY-MM/)
+AGG_PATH_LEGADO = BASE_DIR / 'output_final' / 'dados_agregados.parquet'  # Arquivo único de versões antigas
+BATCH_ROWS = 8192  # Linhas por RecordBatch lido do Parquet
+LOG_A_CADA_LOTES = 64  # Progresso impresso a cada ~512k linhas
+
+
+def _tipo_sqlite(tipo: pa.DataType) -> str:
+    if pa.types.is_dictionary(tipo):
+        tipo = tipo.value_type
+    if pa.types.is_integer(tipo) or pa.types.is_boolean(tipo):
+        return 'INTEGER'
+    if pa.types.is_floating(tipo):
+        return 'REAL'
+    return 'TEXT'
 
 
 def carregar_em_chunks_para_sql(conn: sqlite3.Connection, table_name: str = 'dados_agregados') -> None:
     """
     Lê o Parquet (que contém SOMAS) e o carrega no SQLite.
     """
-    if not AGG_PATH.exists():
+    if AGG_PATH.exists():
+        origem = AGG_PATH
+        dataset = ds.dataset(
+            AGG_PATH, format='parquet',
+            partitioning=ds.partitioning(pa.schema([('data', pa.string())]), flavor='hive'),
+        )
+    elif AGG_PATH_LEGADO.exists():
+        origem = AGG_PATH_LEGADO
+        dataset = ds.dataset(AGG_PATH_LEGADO, format='parquet')
+    else:
         raise FileNotFoundError(
             f'Arquivo {AGG_PATH} não encontrado. Execute processador_agregado.py antes.'
         )
-    pf = pq.ParquetFile(AGG_PATH)
 
     try:
-        total_rows_meta = pf.metadata.num_rows
+        total_rows_meta = dataset.count_rows()
     except Exception:
         total_rows_meta = None
 
@@ -34,32 +55,82 @@ def carregar_em_chunks_para_sql(conn: sqlite3.Connection, table_name: str = 'dad
     # Limpa a tabela de destino
     print(f'>> Preparando tabela {table_name!r} no banco {DB_PATH.name!r}...')
     conn.execute(f'DROP TABLE IF EXISTS {table_name}')
+    # Schema explícito a partir do Parquet: o INSERT não depende de inferência de tipos
+    schema = dataset.schema
+    colunas = ', '.join(f'"{f.name}" {_tipo_sqlite(f.type)}' for f in schema)
+    conn.execute(f'CREATE TABLE {table_name} ({colunas})')
     conn.commit()
+    nomes = ', '.join(f'"{n}"' for n in schema.names)
+    insert_sql = f'INSERT INTO {table_name} ({nomes}) VALUES ({", ".join(["?"] * len(schema.names))})'
 
     print(
-        f'>> Iniciando carga do Parquet: {AGG_PATH.name}' +
+        f'>> Iniciando carga do Parquet: {origem.name}' +
         (f" | linhas totais (meta): {total_rows_meta:,}" if total_rows_meta is not None else '')
     )
 
     inicio = perf_counter()
     carregadas = 0
     
-    # Itera sobre os "row groups" do Parquet para eficiência de memória
-    for i in range(pf.num_row_groups):
-        df = pf.read_row_group(i).to_pandas()
-        df.to_sql(table_name, conn, if_exists='append', index=False, chunksize=5000)
-
-        carregadas += len(df)
+    # Itera em lotes pequenos (cabem no cache) direto das colunas Arrow, sem pandas nem to_sql; uma transação só
+    conn.execute('BEGIN')
+    for i, batch in enumerate(dataset.to_batches(batch_size=BATCH_ROWS), start=1):
+        conn.executemany(insert_sql, zip(*(col.to_pylist() for col in batch.columns)))
+
+        carregadas += batch.num_rows
+        if i % LOG_A_CADA_LOTES:
+            continue
         decorrido = perf_counter() - inicio
         if total_rows_meta:
             pct = (carregadas / total_rows_meta) * 100
-            print(f"   - RG {i+1}/{pf.num_row_groups}: +{len(df):,} linhas (acum {carregadas:,}/{total_rows_meta:,} | {pct:5.1f}%) em {decorrido:0.1f}s")
+            print(f"   - Lote {i}: acum {carregadas:,}/{total_rows_meta:,} linhas ({pct:5.1f}%) em {decorrido:0.1f}s")
         else:
-            print(f"   - RG {i+1}/{pf.num_row_groups}: +{len(df):,} linhas (acum {carregadas:,}) em {decorrido:0.1f}s")
+            print(f"   - Lote {i}: acum {carregadas:,} linhas em {decorrido:0.1f}s")
 
+    conn.commit()
     print(f'>> Concluído: {carregadas:,} linhas carregadas em {table_name!r} em {perf_counter()-inicio:0.1f}s')
 
 
+def criar_colunas_derivadas(conn: sqlite3.Connection, table_name: str = 'dados_agregados') -> None:
+    """
+    Colunas geradas (VIRTUAL) para a divisão CNAE e a UF do município, mais os índices
+    de cobertura: a agregação da regressão vira varredura só do índice, sem SUBSTR por linha,
+    e os GROUP BY por data do dashboard (app.py) e dos gráficos (graficos/) também.
+    Roda após cada recriação da tabela; os leitores não fazem DDL.
+    """
+    print(f'>> Criando colunas derivadas e índices de cobertura em {table_name!r}...')
+    colunas = {r[1] for r in conn.execute(f'PRAGMA table_xinfo({table_name})')}
+    if 'cnae_divisao' not in colunas:
+        conn.execute(
+            f'ALTER TABLE {table_name} ADD COLUMN cnae_divisao TEXT '
+            'GENERATED ALWAYS AS (substr(cnae20subclasse, 1, 2)) VIRTUAL'
+        )
+    if 'uf_code' not in colunas:
+        conn.execute(
+            f'ALTER TABLE {table_name} ADD COLUMN uf_code TEXT '
+            'GENERATED ALWAYS AS (substr(municipio, 1, 2)) VIRTUAL'
+        )
+    conn.execute(
+        f'CREATE INDEX IF NOT EXISTS idx_da_cov ON {table_name} '
+        '(cnae_divisao, uf_code, genero, raca_cor, grau_instrucao, "tipodedeficiência", '
+        'total_admissoes, soma_salario, soma_idade)'
+    )
+    # Dashboard: KPIs e histórico filtrados por período
+    conn.execute(
+        f'CREATE INDEX IF NOT EXISTS idx_dados_data_cats ON {table_name} '
+        '(data, genero, raca_cor, grau_instrucao, "tipodedeficiência", total_admissoes, soma_salario, soma_idade)'
+    )
+    # Gráficos: GROUP BY data, <coluna>
+    conn.execute(
+        f'CREATE INDEX IF NOT EXISTS idx_agg_data_esc ON {table_name} (data, grau_instrucao, total_admissoes)'
+    )
+    conn.execute(
+        f'CREATE INDEX IF NOT EXISTS idx_agg_data_def ON {table_name} '
+        '(data, "tipodedeficiência", total_admissoes, soma_salario)'
+    )
+    conn.execute('ANALYZE')
+    conn.commit()
+
+
 def criar_tabelas_modelos(conn: sqlite3.Connection) -> None:
     """
     (CORRIGIDO v8 - NOVA METODOLOGIA)
@@ -78,13 +149,10 @@ def criar_tabelas_modelos(conn: sqlite3.Connection) -> None:
         'salario_real REAL,'
         'salario_projetado REAL,'
         'salario_projetado_low REAL,'
-        'salario_projetado_high REAL'
+        'salario_projetado_high REAL,'
+        'PRIMARY KEY (filtro_tipo, filtro_valor, grupo_tipo, grupo_valor, data)'  # Também serve às buscas por cenário/grupo
         ')'
     )
-    conn.execute(
-        'CREATE INDEX IF NOT EXISTS idx_projecoes_salariais '
-        'ON projecoes_salariais (filtro_tipo, filtro_valor, grupo_tipo)'
-    )
     
     conn.execute('DROP TABLE IF EXISTS coeficientes_regressao') # Garante schema limpo
     conn.execute(
@@ -102,6 +170,7 @@ def popular_banco() -> None:
     with sqlite3.connect(DB_PATH) as conn:
         criar_tabelas_modelos(conn)
         carregar_em_chunks_para_sql(conn, 'dados_agregados')
+        criar_colunas_derivadas(conn, 'dados_agregados')
         
     print('==> Finalizado.')
 
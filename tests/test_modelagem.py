@@ -0,0 +1,53 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+modelagem = pytest.importorskip('modelagem')
+
+
+def _banco_sintetico(n_linhas: int = 3000, seed: int = 42) -> sqlite3.Connection:
+    rng = np.random.default_rng(seed)
+    conn = sqlite3.connect(':memory:')
+    conn.execute(
+        'CREATE TABLE dados_agregados (genero TEXT, raca_cor TEXT, cnae20subclasse TEXT, grau_instrucao TEXT, '
+        '"tipodedeficiência" TEXT, municipio TEXT, total_admissoes INTEGER, soma_salario REAL, soma_idade REAL)'
+    )
+    total = rng.integers(1, 50, n_linhas)
+    linhas = zip(
+        rng.choice(['1', '3'], n_linhas),
+        rng.choice(['1', '2', '3', '4', '5', '9'], n_linhas),
+        rng.choice(['4711301', '5611201', '8610101', '6201501'], n_linhas),
+        rng.choice(['2', '5', '7', '9'], n_linhas),
+        rng.choice(['0', '1', '9'], n_linhas),
+        rng.choice(['355030', '330455', '410690', '530010'], n_linhas),
+        total.tolist(),
+        (total * rng.uniform(1200, 9000, n_linhas)).tolist(),
+        (total * rng.uniform(18, 60, n_linhas)).tolist(),
+    )
+    conn.executemany('INSERT INTO dados_agregados VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', linhas)
+    return conn
+
+
+def test_regressao_equacoes_normais_igual_statsmodels(monkeypatch):
+    # Blocos pequenos para exercitar a acumulação de X'X em várias passadas
+    monkeypatch.setattr(modelagem, 'REGRESSAO_CHUNK', 97)
+    conn = _banco_sintetico()
+    total = modelagem.carregar_dados_para_regressao(conn)
+    modelagem.rodar_regressao(total, conn)
+    obtido = pd.read_sql('SELECT * FROM coeficientes_regressao', conn).set_index('variavel')
+
+    df = pd.read_sql('SELECT * FROM temp.regressao_grupos', conn)
+    cats = modelagem.REGRESSAO_CATEGORIAS
+    for coluna in cats:
+        df[coluna] = modelagem._normalizar_categoria(df[coluna], coluna)
+    X = pd.get_dummies(df[cats], prefix=cats, drop_first=True, dtype=np.float64)
+    X['idade_media'] = df['idade_media'].fillna(0)
+    X = sm.add_constant(X, has_constant='add')
+    esperado = sm.OLS(np.log(df['salario_medio']), X).fit()
+
+    assert list(obtido.index) == list(esperado.params.index)
+    np.testing.assert_allclose(obtido['coeficiente'], esperado.params, rtol=1e-6, atol=1e-9)
+    np.testing.assert_allclose(obtido['p_valor'], esperado.pvalues, rtol=1e-5, atol=1e-9)
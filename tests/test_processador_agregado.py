@@ -0,0 +1,105 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+processador_agregado = pytest.importorskip('processador_agregado')
+
+AGG_KEYS = processador_agregado.AGG_KEYS
+
+
+def _agregar_sqlite(path, tmp_path) -> pd.DataFrame:
+    """Caminho sem DuckDB: upsert no staging SQLite, como em processar_incremental."""
+    with sqlite3.connect(tmp_path / 'aggs_temp.db') as conn:
+        processador_agregado._prepare_sqlite(conn)
+        conn.execute('BEGIN')
+        processador_agregado.agregar_arquivo(path, conn)
+        conn.execute('COMMIT')
+        df = pd.read_sql('SELECT * FROM aggs', conn)
+    return df.sort_values(AGG_KEYS).reset_index(drop=True)
+
+
+def test_parquet_com_chaves_categoricas_colidindo_apos_trim(tmp_path):
+    df = pd.DataFrame({
+        'competencia_mov': ['202301'] * 5,
+        'municipio': [' 355030', '355030', '330455', '330455 ', '355030'],
+        'cnae20subclasse': ['4711301'] * 5,
+        'grau_instrucao': ['7', '7 ', '5', '5', '7'],
+        'genero': [' 3', '1', '3', '1 ', '3'],
+        'raca_cor': ['1', '1', '2', '2', '1'],
+        'tipodedeficiência': ['0'] * 5,
+        'salario': [1500.5, 2000.0, 3000.0, 1200.0, 1800.0],
+        'idade': [30, 40, 25, 50, 35],
+    })
+    chaves = [c for c in df.columns if c not in ('salario', 'idade')]
+    path = tmp_path / 'CAGEDMOV_limpo_202301.parquet'
+    df.astype({c: 'category' for c in chaves}).to_parquet(path, index=False)
+
+    obtido = _agregar_sqlite(path, tmp_path)
+
+    limpo = df.assign(**{c: df[c].str.strip() for c in chaves}, data='2023-01')
+    esperado = (
+        limpo.groupby(AGG_KEYS)
+        .agg(sum_salario=('salario', 'sum'), sum_idade=('idade', 'sum'), n=('salario', 'size'))
+        .reset_index()
+        .sort_values(AGG_KEYS)
+        .reset_index(drop=True)
+    )
+    pd.testing.assert_frame_equal(obtido, esperado, check_dtype=False)
+
+
+@pytest.mark.parametrize('salarios', [
+    ['1500.50', '2000.00', '1412.00', '3250.75'],
+    ['1.500,50', '2.000,00', '1.412,00', '3.250,75'],
+])
+def test_csv_salario_ponto_ou_virgula_decimal(tmp_path, salarios):
+    df = pd.DataFrame({
+        'competencia_mov': ['202105'] * 4,
+        'municipio': ['355030', '355030', '330455', '330455'],
+        'cnae20subclasse': ['4711301'] * 4,
+        'grau_instrucao': ['7', '7', '5', '5'],
+        'genero': ['1', '3', '1', '3'],
+        'raca_cor': ['1', '1', '2', '2'],
+        'tipodedeficiência': ['0'] * 4,
+        'salario': salarios,
+        'idade': ['30', '40', '25', '50'],
+    })
+    path = tmp_path / 'CAGEDMOV_limpo_202105.csv'
+    df.to_csv(path, index=False)
+
+    obtido = _agregar_sqlite(path, tmp_path)
+
+    assert len(obtido) == 4
+    assert obtido['n'].sum() == 4
+    assert obtido['sum_salario'].sum() == pytest.approx(1500.50 + 2000.00 + 1412.00 + 3250.75)
+
+
+def test_upsert_sqlite_casa_chaves_nulas(tmp_path):
+    df = pd.DataFrame({
+        'competencia_mov': ['202301'] * 2,
+        'municipio': ['355030'] * 2,
+        'cnae20subclasse': ['4711301'] * 2,
+        'grau_instrucao': [None, None],
+        'genero': ['1', '1'],
+        'raca_cor': ['1', '1'],
+        'tipodedeficiência': [None, None],
+        'salario': [1500.0, 2500.0],
+        'idade': [30, 40],
+    })
+    chaves = [c for c in df.columns if c not in ('salario', 'idade')]
+    arquivos = []
+    for i in range(2):
+        path = tmp_path / f'CAGEDMOV_limpo_20230{i + 1}.parquet'
+        df.iloc[[i]].astype({c: 'category' for c in chaves}).to_parquet(path, index=False)
+        arquivos.append(path)
+
+    with sqlite3.connect(tmp_path / 'aggs_temp.db') as conn:
+        processador_agregado._prepare_sqlite(conn)
+        for path in arquivos:
+            conn.execute('BEGIN')
+            processador_agregado.agregar_arquivo(path, conn)
+            conn.execute('COMMIT')
+        linhas = conn.execute('SELECT n, sum_salario FROM aggs').fetchall()
+
+    assert linhas == [(2, 4000.0)]